@@ -37,25 +37,117 @@ which serves a similar purpose in the graphics primitive world.
 #   function using Tkimages.  N.B.  Tk restricts image types to gif or ppm
 #
 
-try:
-    import tkinter
-except:
-    import Tkinter as tkinter
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
 
 pilAvailable = True
 try:
     from PIL import Image as PIL_Image
-    from PIL import ImageTk
 except:
     pilAvailable = False
 
 #import exceptions
 
-# Borrow some ideas from Zelle
-# create an invisible global main root for all windows
-tk = tkinter
-_imroot = tk.Tk()
-_imroot.withdraw()
+# Tk (and PIL's ImageTk) are only imported and initialised the first time a
+# window is opened or an image is drawn, so the module can be used headless,
+# e.g. on servers without a display.  ImageWin is created on first access.
+_tkmodule = None
+_imroot = None
+
+def _tk():
+    """Return the tkinter module.  On first use import it and create the
+    invisible global main root for all windows."""
+    global _tkmodule, _imroot
+    if _imroot is None:
+        try:
+            import tkinter as tkmodule
+        except ImportError:
+            import Tkinter as tkmodule
+        # Borrow some ideas from Zelle
+        # create an invisible global main root for all windows
+        _imroot = tkmodule.Tk()
+        _imroot.withdraw()
+        _tkmodule = tkmodule
+    return _tkmodule
+
+def _loadImageWin():
+    """Create the ImageWin class (a Tk canvas) on first use"""
+    if "ImageWin" in globals():
+        return globals()["ImageWin"]
+    tk = _tk()
+
+    class ImageWin(tk.Canvas):
+        """
+        ImageWin:  Make a frame to display one or more images.
+        """
+        def __init__(self,title="image window",width=640,height=640):        
+            """
+            Create a window with a title, width and height.
+            """
+            master = tk.Toplevel(_imroot)
+            master.protocol("WM_DELETE_WINDOW", self._close)
+            #super(ImageWin, self).__init__(master, width=width, height=height)
+            tk.Canvas.__init__(self, master, width=width, height=height)
+            self.master.title(title)
+            self.pack()
+            master.resizable(0,0)
+            self.foreground = "black"
+            self.items = []
+            self.mouseX = None
+            self.mouseY = None
+            self.bind("<Button-1>", self._onClick)
+            self.height = height
+            self.width = width
+            self._mouseCallback = None
+            self.trans = None
+            _imroot.update()
+
+        def _close(self):
+            """Close the window"""
+            self.master.destroy()
+            self.quit()
+            _imroot.update()
+
+        def getMouse(self):
+            """Wait for mouse click and return a tuple with x,y position in screen coordinates after
+            the click"""
+            self.mouseX = None
+            self.mouseY = None
+            while self.mouseX is None or self.mouseY is None:
+                self.update()
+            return ((self.mouseX,self.mouseY))
+
+        def setMouseHandler(self, func):
+            self._mouseCallback = func
+
+        def _onClick(self, e):
+            self.mouseX = e.x
+            self.mouseY = e.y
+            if self._mouseCallback:
+                self._mouseCallback(e.x, e.y)
+
+        def exitOnClick(self):
+            """When the Mouse is clicked close the window and exit"""
+            self.getMouse()
+            self._close()
+        
+        def exitonclick(self):
+            self.exitOnClick()
+
+    globals()["ImageWin"] = ImageWin
+    return ImageWin
+
+def __getattr__(name):
+    """Import Tk lazily when ImageWin, tk or tkinter are accessed"""
+    if name == "ImageWin":
+        return _loadImageWin()
+    if name in ("tk", "tkinter"):
+        return _tk()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 def formatPixel(data):
     if type(data) == tuple:
@@ -63,108 +155,70 @@ def formatPixel(data):
     elif isinstance(data,Pixel):
         return '{#%02x%02x%02x}'%data.getColorTuple()
 
-class ImageWin(tk.Canvas):
-    """
-    ImageWin:  Make a frame to display one or more images.
-    """
-    def __init__(self,title="image window",width=640,height=640):        
-        """
-        Create a window with a title, width and height.
-        """
-        master = tk.Toplevel(_imroot)
-        master.protocol("WM_DELETE_WINDOW", self._close)
-        #super(ImageWin, self).__init__(master, width=width, height=height)
-        tk.Canvas.__init__(self, master, width=width, height=height)
-        self.master.title(title)
-        self.pack()
-        master.resizable(0,0)
-        self.foreground = "black"
-        self.items = []
-        self.mouseX = None
-        self.mouseY = None
-        self.bind("<Button-1>", self._onClick)
-        self.height = height
-        self.width = width
-        self._mouseCallback = None
-        self.trans = None
-        _imroot.update()
-
-    def _close(self):
-        """Close the window"""
-        self.master.destroy()
-        self.quit()
-        _imroot.update()
 
-    def getMouse(self):
-        """Wait for mouse click and return a tuple with x,y position in screen coordinates after
-        the click"""
-        self.mouseX = None
-        self.mouseY = None
-        while self.mouseX is None or self.mouseY is None:
-            self.update()
-        return ((self.mouseX,self.mouseY))
-
-    def setMouseHandler(self, func):
-        self._mouseCallback = func
-
-    def _onClick(self, e):
-        self.mouseX = e.x
-        self.mouseY = e.y
-        if self._mouseCallback:
-            self._mouseCallback(e.x, e.y)
-
-    def exitOnClick(self):
-        """When the Mouse is clicked close the window and exit"""
-        self.getMouse()
-        self._close()
-        
-    def exitonclick(self):
-        self.exitOnClick()
+class Pixel(object):
+    """This simple class abstracts the RGB pixel values.
 
+    Pixels are created and thrown away by the million, so they are kept as
+    small as possible: the components live in slots (no instance __dict__) and
+    assigning red, green or blue is not range checked.  Validation is deferred
+    until the pixel is written back with setPixel, see checkRange.
+    """
+    __slots__ = ('red', 'green', 'blue', '_max')
 
-class Pixel(object):
-    """This simple class abstracts the RGB pixel values."""
     def __init__(self, red, green, blue):
-        super(Pixel, self).__init__()
-        self.__red = red
-        self.__green = green
-        self.__blue = blue
-        self.max = 255
+        self.red = red
+        self.green = green
+        self.blue = blue
+        self._max = 255
 
     def getRed(self):
         """Return the red component of the pixel"""
-        return self.__red
+        return self.red
 
     def getGreen(self):
         """Return the green component of the pixel"""
-        return self.__green
+        return self.green
 
     def getBlue(self):
         """Return the blue component of the pixel"""
-        return self.__blue
+        return self.blue
 
     def getColorTuple(self):
         """Return all color information as a tuple"""
-        return (self.__red, self.__green, self.__blue)
+        return (self.red, self.green, self.blue)
+
+    def getMax(self):
+        """Return the upper bound of the pixel range, 255 unless changed by setRange"""
+        return self._max
+
+    def checkRange(self):
+        """Return the color tuple, or raise a ValueError if a component is out of range"""
+        red, green, blue, pmax = self.red, self.green, self.blue, self._max
+        if pmax >= red >= 0 and pmax >= green >= 0 and pmax >= blue >= 0:
+            return (red, green, blue)
+        for value in (red, green, blue):
+            if not pmax >= value >= 0:
+                raise ValueError("Error:  pixel value %d is out of range" % value)
 
     def setRed(self,red):
         """Modify the red component"""
-        if self.max >= red >= 0:
-            self.__red = red
+        if self._max >= red >= 0:
+            self.red = red
         else:
             raise ValueError("Error:  pixel value %d is out of range" % red)
 
     def setGreen(self,green):
         """Modify the green component"""
-        if self.max >= green >= 0:
-            self.__green = green
+        if self._max >= green >= 0:
+            self.green = green
         else:
             raise ValueError("Error:  pixel value %d is out of range" % green)
 
     def setBlue(self,blue):
         """Modify the blue component"""
-        if self.max >= blue >= 0:
-            self.__blue = blue
+        if self._max >= blue >= 0:
+            self.blue = blue
         else:
             raise ValueError("Error:  pixel value %d is out of range" % blue)
 
@@ -175,23 +229,31 @@ class Pixel(object):
            2 --> blue
         """
         if key == 0:
-            return self.__red
+            return self.red
         elif key == 1:
-            return self.__green
+            return self.green
         elif key == 2:
-            return self.__blue
+            return self.blue
         else:
             raise ValueError("Error %d Index out of range" % key)
 
+    def __iter__(self):
+        return iter((self.red, self.green, self.blue))
+
+    def __len__(self):
+        return 3
+
     def setRange(self,pmax):
         """docstring for setRange"""
         if pmax == 1.0:
-            self.max = 1.0
+            self._max = 1.0
         elif pmax == 255:
-            self.max = 255
+            self._max = 255
         else:
             raise ValueError("Error range must be 1.0 or 256")
 
+    max = property(getMax, None, None, "The upper bound of the pixel range.")
+
     def __str__(self):
         return str(self.getColorTuple())
 
@@ -199,9 +261,70 @@ class Pixel(object):
         """docstring for __repr__"""
         return str(self.getColorTuple())
 
-    red = property(getRed, setRed, None, "I'm the red property.")
-    green = property(getGreen, setGreen, None, "I'm the green property.")
-    blue = property(getBlue, setBlue, None, "I'm the blue property.")
+class Stats(object):
+    """Timings and counters for instrumented images, see AbstractImage.instrument.
+
+    A phase records the wall and cpu time of a block of code and how often it
+    ran, a count how often something happened (getPixel calls, bytes written).
+    If given, callback(name, wall, cpu) is called at the end of every phase,
+    e.g. to feed a metrics system.  Phases and counters may be used from
+    several threads.  The cpu time is time.process_time(), which covers the
+    whole process: while phases overlap on several threads, each of them is
+    also charged the cpu time of the others.
+    """
+    def __init__(self, callback=None):
+        self.phases = {}
+        self.counts = {}
+        self.callback = callback
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the body of a with statement as phase name"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            with self.lock:
+                total = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+                total["wall"] += wall
+                total["cpu"] += cpu
+                total["calls"] += 1
+            if self.callback is not None:
+                self.callback(name, wall, cpu)
+
+    def count(self, name, n=1):
+        """Add n to counter name"""
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def counted(self, name, func):
+        """Return func wrapped so that every call adds 1 to counter name"""
+        counts, lock = self.counts, self.lock
+        with lock:
+            counts.setdefault(name, 0)
+        def call(*args):
+            with lock:
+                counts[name] += 1
+            return func(*args)
+        return call
+
+    def toDict(self):
+        """Return the phases and counters as a dict"""
+        with self.lock:
+            return {"phases": dict((name, dict(total)) for name, total in self.phases.items()),
+                    "counts": dict(self.counts)}
+
+    def dump(self, fname=None):
+        """Return the stats as JSON, and also write them to fname if given"""
+        data = json.dumps(self.toDict(), indent=2, sort_keys=True)
+        if fname is not None:
+            with open(fname, "w") as f:
+                f.write(data)
+        return data
+
 
 class AbstractImage(object):
     """
@@ -211,9 +334,13 @@ class AbstractImage(object):
     3. From another image object
     4. By specifying the height and width to create a blank image.
     """
-    imageCache = {} # tk photoimages go here to avoid GC while drawn 
+    # Tk photoimages go here to avoid GC while drawn: imageId -> (photo,
+    # canvas, item).  Beyond imageCacheSize entries the least recently drawn
+    # ones that are no longer on a canvas are released, see cacheImage().
+    imageCache = collections.OrderedDict()
+    imageCacheSize = 32
     imageId = 1
-    def __init__(self,fname=None,data=[],imobj=None,height=0,width=0):
+    def __init__(self,fname=None,data=[],imobj=None,height=0,width=0,draft=None):
         """
         An image can be created using any of the following keyword parameters. When image creation is 
         complete the image will be an rgb image.
@@ -223,8 +350,12 @@ class AbstractImage(object):
         imobj:  Make a copy of another image.
         height:
         width: Create a blank image of a particular height and width.
+        draft: A (width, height) the image in fname may be decoded at instead of its
+        full size, see loadPILImage.
         """
         super(AbstractImage, self).__init__()
+        # The Stats object of an instrumented image, see instrument().
+        self.stats = None
 
         # if PIL is available then use the PIL functions otherwise fall back to Tk
         if pilAvailable:
@@ -232,16 +363,22 @@ class AbstractImage(object):
             self.createBlankImage = self.createBlankPILImage
             self.setPixel = self.setPILPixel
             self.getPixel = self.getPILPixel
+            self.getRegion = self.getPILRegion
+            self.setRegion = self.setPILRegion
+            self.applyLookup = self.applyPILLookup
             self.save = self.savePIL
         else:
             self.loadImage = self.loadTkImage
             self.createBlankImage = self.createBlankTkImage
             self.setPixel = self.setTkPixel
             self.getPixel = self.getTkPixel
+            self.getRegion = self.getTkRegion
+            self.setRegion = self.setTkRegion
+            self.applyLookup = self.applyTkLookup
             self.save = self.saveTk
 
         if fname:
-            self.loadImage(fname)
+            self.loadImage(fname,draft)
             self.imFileName = fname
         elif data:
             height = len(data)
@@ -263,13 +400,19 @@ class AbstractImage(object):
         self.centerX = self.width/2+3     # +3 accounts for the ~3 pixel border in Tk windows
         self.centerY = self.height/2+3
         self.id = None
+        self.preview = False
 
-    def loadPILImage(self,fname):
+    def loadPILImage(self,fname,draft=None):
+        """Load fname.  With a draft (width, height), JPEGs are decoded at the
+        smallest reduced scale (1/2, 1/4 or 1/8) that is still at least that
+        large, which is a lot faster than decoding them at full size."""
         self.im = PIL_Image.open(fname)
+        if draft is not None:
+            self.im.draft("RGB",draft)
         ni = self.im.convert("RGB")
         self.im = ni
 
-    def loadTkImage(self,fname):
+    def loadTkImage(self,fname,draft=None):
         sufstart = fname.rfind('.')
         if sufstart < 0:
             suffix = ""
@@ -277,7 +420,7 @@ class AbstractImage(object):
             suffix = fname[sufstart:]
         if suffix not in ['.gif', '.ppm']:
             raise ValueError("Bad Image Type: %s : Without PIL, only .gif or .ppm files are allowed" % suffix)
-        self.im = tkinter.PhotoImage(file=fname)
+        self.im = _tk().PhotoImage(file=fname)
 
     def createBlankPILImage(self,height,width):
         self.im = PIL_Image.new("RGB",(width,height))
@@ -285,19 +428,41 @@ class AbstractImage(object):
         self.im = ni
 
     def createBlankTkImage(self,height,width):
-        self.im = tkinter.PhotoImage(height=height,width=width)
+        self.im = _tk().PhotoImage(height=height,width=width)
 
 
     def copy(self):
         """Return a copy of this image"""
         newI = AbstractImage(imobj=self.im)
+        if self.stats is not None:
+            newI.instrument(self.stats)
         return newI
 
 
     def clone(self):
          """Return a copy of this image"""
-         newI = AbstractImage(imobj=self.im)
-         return newI
+         return self.copy()
+
+    def instrument(self, stats):
+        """
+        Record the work done on this image in stats (a Stats object): every
+        call of getPixel (one Pixel allocation each), setPixel, getRegion,
+        setRegion and applyLookup is counted, and save() is timed as phase
+        "encode" and counts the "bytes_written".  The methods are rebound on
+        this instance only, images that aren't instrumented pay nothing.
+        Copies of an instrumented image are instrumented, too.
+        """
+        self.stats = stats
+        for name in ("getPixel", "setPixel", "getRegion", "setRegion", "applyLookup"):
+            setattr(self, name, stats.counted(name, getattr(self, name)))
+        save = self.save
+        def instrumentedSave(fname=None, *args, **kwargs):
+            with stats.phase("encode"):
+                save(fname, *args, **kwargs)
+            fname = fname or self.imFileName
+            if os.path.exists(fname):
+                stats.count("bytes_written", os.path.getsize(fname))
+        self.save = instrumentedSave
 
     def getHeight(self):
         """Return the height of the image"""
@@ -310,14 +475,17 @@ class AbstractImage(object):
     def getTkPixel(self,x,y):
         """Get a pixel at the given x,y coordinate.  The pixel is returned as an rgb color tuple
         for eaxamplle foo.getPixel(10,10) --> (10,200,156) """
-        p = [int(j) for j in self.im.get(x,y).split()]
+        p = self.im.get(x,y)
+        # Python 3's tkinter returns a tuple, older ones a string.
+        if isinstance(p,str):
+            p = [int(j) for j in p.split()]
         return Pixel(p[0],p[1],p[2])
 
     def setTkPixel(self,x,y,pixel):
         """Set the color of a pixel at position x,y.  The color must be specified as an rgb tuple (r,g,b) where 
         the rgb values are between 0 and 255."""
         if x < self.getWidth() and y < self.getHeight():
-            self.im.put(formatPixel(pixel.getColorTuple()),(x,y))
+            self.im.put(formatPixel(pixel.checkRange()),(x,y))
         else:
             raise ValueError("Pixel index out of range.")
 
@@ -329,10 +497,83 @@ class AbstractImage(object):
     def setPILPixel(self,x,y,pixel):
         """docstring for setPILPixel"""
         if x < self.getWidth() and y < self.getHeight():
-            self.im.putpixel((x,y),pixel.getColorTuple())
+            self.im.putpixel((x,y),pixel.checkRange())
         else:
             raise ValueError("Pixel index out of range")
 
+    def checkRegion(self,x,y,width,height):
+        """Raise a ValueError unless the rectangle lies completely inside the image"""
+        if x < 0 or y < 0 or width < 0 or height < 0 or \
+           x + width > self.getWidth() or y + height > self.getHeight():
+            raise ValueError("Region index out of range.")
+
+    def getTkRegion(self,x,y,width,height):
+        """Return the pixels of a rectangle as packed rgb bytes, row by row.
+        The whole rectangle is read with a single photo 'data' call, which
+        returns it as rows of #rrggbb colors."""
+        self.checkRegion(x,y,width,height)
+        if width == 0 or height == 0:
+            return b""
+        rows = self.im.tk.splitlist(self.im.tk.call(self.im.name,"data","-from",
+                                                    x,y,x+width,y+height))
+        # fromhex skips the spaces between the colors.
+        return bytes.fromhex(" ".join(row if isinstance(row,str) else " ".join(row)
+                                      for row in rows).replace("#",""))
+
+    def setTkRegion(self,x,y,width,height,data):
+        """Set the pixels of a rectangle from packed rgb bytes, row by row.
+        The whole rectangle is written with a single put of all its rows."""
+        self.checkRegion(x,y,width,height)
+        data = memoryview(data).cast('B')
+        if len(data) != width * height * 3:
+            raise ValueError("Region data must hold %d bytes" % (width * height * 3))
+        if width == 0 or height == 0:
+            return
+        colors = data.hex()
+        stride = width * 6
+        rows = ["{%s}" % " ".join("#" + colors[i:i+6] for i in range(top,top+stride,6))
+                for top in range(0,len(colors),stride)]
+        self.im.put(" ".join(rows),(x,y))
+
+    def getPILRegion(self,x,y,width,height):
+        """Return the pixels of a rectangle as packed rgb bytes, row by row.
+        The whole rectangle is copied out of the PIL image in a single call."""
+        self.checkRegion(x,y,width,height)
+        if (x,y,width,height) == (0,0,self.width,self.height):
+            return self.im.tobytes()
+        return self.im.crop((x,y,x+width,y+height)).tobytes()
+
+    def setPILRegion(self,x,y,width,height,data):
+        """Set the pixels of a rectangle from packed rgb bytes, row by row.
+        The data is wrapped (not copied) and pasted in a single call."""
+        self.checkRegion(x,y,width,height)
+        if len(memoryview(data).cast('B')) != width * height * 3:
+            raise ValueError("Region data must hold %d bytes" % (width * height * 3))
+        region = PIL_Image.frombuffer("RGB",(width,height),data,"raw","RGB",0,1)
+        self.im.paste(region,(x,y))
+
+    def applyTkLookup(self,table):
+        """Map every channel value through a lookup table: 768 ints, 256 each
+        for red, green and blue.  Each channel is translated in one call."""
+        data = bytearray(self.getRegion(0,0,self.width,self.height))
+        for channel in range(3):
+            lut = bytes(table[channel*256:(channel+1)*256])
+            data[channel::3] = bytes(data[channel::3]).translate(lut)
+        self.setRegion(0,0,self.width,self.height,data)
+
+    def applyPILLookup(self,table):
+        """Map every channel value through a lookup table: 768 ints, 256 each
+        for red, green and blue.  PIL applies it in a single pass."""
+        self.im = self.im.point(table)
+
+    def getRow(self,y):
+        """Return row y as packed rgb bytes"""
+        return self.getRegion(0,y,self.width,1)
+
+    def setRow(self,y,data):
+        """Set row y from packed rgb bytes"""
+        self.setRegion(0,y,self.width,1,data)
+
     def setPosition(self,x,y):
         """Set the position in the window where the top left corner of the window should be."""
         self.top = y
@@ -340,22 +581,88 @@ class AbstractImage(object):
         self.centerX = x + (self.width/2)+3
         self.centerY = y + (self.height/2)+3
 
-    def getImage(self):
+    def getImage(self,size=None):
+        """Return a Tk photo image of this image, downsampled to size (a
+        (width, height)) if given"""
         if pilAvailable:
-            return ImageTk.PhotoImage(self.im)
+            _tk()
+            from PIL import ImageTk
+            im = self.im
+            if size is not None and size != (self.width,self.height):
+                # Averages the pixels every preview pixel covers.
+                im = im.resize(size,PIL_Image.BOX)
+            return ImageTk.PhotoImage(im)
         else:
+            if size is not None and size != (self.width,self.height):
+                factor = max(-(-self.width//size[0]),-(-self.height//size[1]))
+                return self.im.subsample(factor)
             return self.im
 
-    def draw(self,win):
-        """Draw this image in the ImageWin window."""
-        ig = self.getImage()
-        self.imageCache[self.imageId] = ig # save a reference else Tk loses it...
-        AbstractImage.imageId = AbstractImage.imageId + 1
+    def previewSize(self,win):
+        """The largest size with our aspect ratio that fits into win, never
+        larger than the image itself"""
+        scale = min(win.width/float(self.width),win.height/float(self.height),1.0)
+        return max(int(self.width*scale),1),max(int(self.height*scale),1)
+
+    def draw(self,win,preview=False):
+        """Draw this image in the ImageWin window.  With preview=True a
+        downsampled copy that fits into the window is drawn instead, which is
+        much cheaper to convert for large images; draw again without preview
+        to show the full resolution.  Drawing again replaces the earlier
+        drawing of this image in the same window."""
+        size = self.previewSize(win) if preview else None
+        ig = self.getImage(size)
+        if self.id is not None and self.canvas is win:
+            win.delete(self.id)
         self.canvas=win
-        self.id = self.canvas.create_image(self.centerX,self.centerY,image=ig)
+        self.photo = ig
+        self.preview = preview
+        # Keep the top left corner where it would be at full size.
+        width,height = size or (self.width,self.height)
+        self.id = self.canvas.create_image(self.centerX-(self.width-width)/2.0,
+                                           self.centerY-(self.height-height)/2.0,image=ig)
+        self.cacheImage(ig,win,self.id)
+        _tk()
+        _imroot.update()
+
+    def cacheImage(self,photo,canvas,item):
+        """Keep a reference to photo while it is shown as item on canvas, else
+        Tk loses it, and release the oldest photos that are no longer shown
+        once the cache holds more than imageCacheSize of them"""
+        cache = AbstractImage.imageCache
+        cache[AbstractImage.imageId] = (photo,canvas,item)
+        AbstractImage.imageId = AbstractImage.imageId + 1
+        for key in list(cache):
+            if len(cache) <= AbstractImage.imageCacheSize:
+                break
+            photo,canvas,item = cache[key]
+            try:
+                shown = canvas.winfo_exists() and canvas.type(item) == "image"
+            except _tk().TclError:
+                shown = False
+            if not shown:
+                del cache[key]
+
+    def drawRegion(self,win,x,y,width,height):
+        """Update a rectangle of this image in the ImageWin window after its
+        pixels changed, instead of drawing all of it again.  Only the
+        rectangle is converted and copied into the photo image on the canvas.
+        Draws the whole image if it isn't shown in win yet; previews are
+        drawn again as a whole."""
+        self.checkRegion(x,y,width,height)
+        if self.id is None or self.canvas is not win or self.preview:
+            self.draw(win,self.id is not None and self.preview)
+            return
+        if pilAvailable:
+            from PIL import ImageTk
+            patch = ImageTk.PhotoImage(self.im.crop((x,y,x+width,y+height)))
+            win.tk.call(str(self.photo),"copy",str(patch),"-to",x,y)
+        # Without PIL the canvas shows self.im itself, which already changed.
         _imroot.update()
 
-    def saveTk(self,fname=None,ftype='gif'):
+    def saveTk(self,fname=None,ftype='gif',strict=False):
+        """Save the image to fname (default: the file it was loaded from).
+        Errors are printed, or raised with strict=True."""
         if fname is None:
             fname = self.imFileName
         sufstart = fname.rfind('.')
@@ -371,9 +678,13 @@ class AbstractImage(object):
         try:
             self.im.write(fname,format=ftype)            
         except:
+            if strict:
+                raise
             print("Error saving, Could Not open ", fname, " to write.")
 
-    def savePIL(self,fname=None,ftype='jpg'):
+    def savePIL(self,fname=None,ftype='jpg',strict=False):
+        """Save the image to fname (default: the file it was loaded from).
+        Errors are printed, or raised with strict=True."""
         if fname is None:
             fname = self.imFileName
         sufstart = fname.rfind('.')
@@ -387,6 +698,8 @@ class AbstractImage(object):
         try:
             self.im.save(fname)            
         except:
+            if strict:
+                raise
             print("Error saving, Could Not open ", fname, " to write.")
 
 
@@ -396,15 +709,14 @@ class AbstractImage(object):
         """
         res = []
         for i in range(self.height):
-            res.append([])
-            for j in range(self.width):
-                res[i].append(self.getPixel(j,i))
+            row = self.getRow(i)
+            res.append([Pixel(row[j],row[j+1],row[j+2]) for j in range(0,len(row),3)])
         return res
 
 
 class FileImage(AbstractImage):
-    def __init__(self,thefile):
-        super(FileImage, self).__init__(fname = thefile)
+    def __init__(self,thefile,draft=None):
+        super(FileImage, self).__init__(fname = thefile, draft = draft)
 
 class Image(FileImage):
         pass
@@ -419,6 +731,7 @@ class ListImage(AbstractImage):
 
 # Example program  Read in an image and calulate the negative.
 if __name__ == '__main__':
+    ImageWin = _loadImageWin()
     win = ImageWin("My Window",480,640)
     oImage = FileImage('example.png')
     print(oImage.getWidth(), oImage.getHeight())
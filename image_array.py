@@ -0,0 +1,543 @@
+""" Image Array: NumPy engine for image_filter
+
+    Runs the filters of ImageFilter on a whole (height, width, 3) uint8 array
+    in batched passes instead of looping over Pixel objects. With the default
+    arguments every filter here reproduces the output of the matching
+    ImageFilter method pixel for pixel, so both engines can be compared on the
+    same input.
+"""
+
+
+import numpy as np
+
+import image_matrix
+import image_ppm
+import image_resample
+
+
+def to_array(img):
+    """Return the pixels of a cImage image as a read-only (height, width, 3)
+    uint8 array, fetched with a single getRegion call"""
+    width, height = img.getWidth(), img.getHeight()
+    data = img.getRegion(0, 0, width, height)
+    return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+
+
+def from_array(img, arr):
+    "Write a (height, width, 3) uint8 array back into a cImage image"
+    arr = np.ascontiguousarray(arr, dtype=np.uint8)
+    height, width = arr.shape[:2]
+    img.setRegion(0, 0, width, height, arr)
+
+
+def load_ppm(filename):
+    """Return the pixels of a binary PPM or PGM file as a read-only
+    (height, width, 3) uint8 array. PPM pixels are not copied, the array sits
+    on a memory map of the file; PGM files are expanded to three channels.
+    Meant for NumPy code of your own: ImageFilter keeps its pixels in a PIL
+    image, so it reads PPM files through PIL."""
+    ppm = image_ppm.PPMFile(filename)
+    arr = np.frombuffer(ppm.data, dtype=np.uint8).reshape(ppm.height, ppm.width,
+                                                          ppm.channels)
+    if ppm.channels == 1:
+        arr = np.repeat(arr, 3, axis=2)
+    # The mapping stays open for as long as the array uses it.
+    ppm.close()
+    return arr
+
+
+def save_ppm(filename, arr):
+    "Write a (height, width, 3) uint8 array to a binary PPM file"
+    height, width = arr.shape[:2]
+    with image_ppm.create(filename, width, height) as ppm:
+        np.frombuffer(ppm.data, dtype=np.uint8).reshape(arr.shape)[...] = arr
+
+
+def intensity(arr):
+    """Return the r+g+b sum of every pixel as a (height, width) int32 plane.
+    A plane is returned as it is, so filters that only need the intensity
+    accept either."""
+    if arr.ndim == 2:
+        return arr
+    return arr.sum(axis=2, dtype=np.int32)
+
+
+def grey_planes(plane):
+    "Stack a single (height, width) plane into an RGB array"
+    plane = plane.astype(np.uint8)
+    return np.dstack((plane, plane, plane))
+
+
+def apply_lut(arr, lut):
+    "Map every channel through a 768 entry lookup table from image_lut"
+    tables = np.asarray(lut, dtype=np.uint8).reshape(3, 256)
+    out = np.empty_like(arr)
+    for channel in range(3):
+        out[..., channel] = tables[channel][arr[..., channel]]
+    return out
+
+
+def greyscale(arr):
+    "Replace each pixel with the (floored) average of its RGB values"
+    return grey_planes(intensity(arr) // 3)
+
+
+def apply_matrix(arr, matrix):
+    """Apply a fixed point colour matrix from image_matrix to every pixel,
+    with the same rounding and clamping as image_matrix.apply_pixel"""
+    r, g, b = [arr[..., i].astype(np.int64) for i in range(3)]
+    out = np.empty_like(arr)
+    for channel in range(3):
+        wr, wg, wb = matrix[3*channel:3*channel + 3]
+        value = r * wr + g * wg + b * wb + (matrix[9 + channel] + image_matrix.HALF)
+        out[..., channel] = np.clip(value >> image_matrix.SHIFT, 0, 255)
+    return out
+
+
+## Neighborhood filters.
+# Every neighborhood filter reads from its (unmodified) input array and takes
+# an explicit border mode that decides what happens outside the image:
+#   shrink   - the window is cut off at the border, only real pixels count.
+#   nearest  - the outermost row/column is repeated.
+#   reflect  - the image is mirrored at the border (without the edge pixel).
+#   constant - everything outside the image is black.
+BORDERS = ("shrink", "nearest", "reflect", "constant")
+KERNELS = ("box", "gaussian")
+_PAD_MODES = {"nearest": "edge", "reflect": "reflect", "constant": "constant"}
+
+
+def check_border(border, modes=BORDERS):
+    "Raise a ValueError for unknown border modes"
+    if border not in modes:
+        raise ValueError("Unknown border mode %r, use one of %s" % (border, modes))
+
+
+def check_radius(radius):
+    "Raise a ValueError unless radius is a non-negative integer"
+    if int(radius) != radius or radius < 0:
+        raise ValueError("The radius must be a non-negative integer, not %r" % radius)
+
+
+def pad(arr, radius, border):
+    "Pad the two image axes of arr by radius pixels according to border"
+    check_border(border, tuple(_PAD_MODES))
+    width = ((radius, radius), (radius, radius)) + ((0, 0),) * (arr.ndim - 2)
+    return np.pad(arr, width, mode=_PAD_MODES[border])
+
+
+def integral(arr):
+    """Return the summed-area table of arr with a leading row and column of
+    zeros: table[y, x] is the sum of arr[:y, :x]"""
+    height, width = arr.shape[:2]
+    table = np.zeros((height + 1, width + 1) + arr.shape[2:], dtype=np.int64)
+    np.cumsum(arr, axis=0, dtype=np.int64, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+
+def window_bounds(size, radius, offset, limit):
+    "Return the start and stop indices of each pixel's window along one axis"
+    centers = np.arange(size) + offset
+    return (np.clip(centers - radius, 0, limit),
+            np.clip(centers + radius + 1, 0, limit))
+
+
+def box_sums(arr, radius, border="shrink"):
+    """Box sums
+
+    Return (sums, counts): the sum of every (2*radius+1)**2 window of arr and
+    the number of pixels in it. Both come from an integral image, so the cost
+    per pixel does not depend on the radius."""
+    check_radius(radius)
+    check_border(border)
+    height, width = arr.shape[:2]
+    offset = 0
+    if border != "shrink":
+        arr = pad(arr, radius, border)
+        offset = radius
+    table = integral(arr)
+    y0, y1 = window_bounds(height, radius, offset, arr.shape[0])
+    x0, x1 = window_bounds(width, radius, offset, arr.shape[1])
+    y0, y1 = y0[:, None], y1[:, None]
+    sums = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+    counts = (y1 - y0) * (x1 - x0)
+    return sums, counts
+
+
+def box_blur(arr, radius=1, border="shrink"):
+    """Box blur
+
+    Replace each pixel with the (floored) mean of the window around it. With
+    radius=1 and the shrink border this is the original ImageFilter.average."""
+    sums, counts = box_sums(arr, radius, border)
+    if sums.ndim == 3:
+        counts = counts[..., None]
+    return (sums // counts).astype(np.uint8)
+
+
+def gaussian_kernel(sigma, radius=None):
+    "Return a normalised 1d Gaussian kernel, radius defaults to ceil(3*sigma)"
+    if sigma <= 0:
+        raise ValueError("sigma must be positive, not %r" % sigma)
+    if radius is None:
+        radius = int(np.ceil(3 * sigma))
+    check_radius(radius)
+    taps = np.arange(-radius, radius + 1, dtype=np.float64)
+    kernel = np.exp(-taps ** 2 / (2.0 * sigma ** 2))
+    return kernel / kernel.sum()
+
+
+def convolve_axis(arr, kernel, axis, border="shrink"):
+    """Convolve arr with a symmetric 1d kernel along one image axis.
+
+    With the shrink border the taps that fall outside the image are dropped
+    and the remaining weights are renormalised."""
+    check_border(border)
+    radius = len(kernel) // 2
+    size = arr.shape[axis]
+    width = [(0, 0)] * arr.ndim
+    width[axis] = (radius, radius)
+    mode = _PAD_MODES.get(border, "constant")
+    padded = np.pad(arr.astype(np.float64), width, mode=mode)
+    # Which taps of the padded axis hold real pixels (all of them, unless
+    # the window shrinks at the border).
+    inside = np.pad(np.ones(size), radius, mode="constant")
+    if border != "shrink":
+        inside[:] = 1
+    out = np.zeros(arr.shape)
+    weights = np.zeros(size)
+    for tap, weight in enumerate(kernel):
+        index = [slice(None)] * arr.ndim
+        index[axis] = slice(tap, tap + size)
+        out += weight * padded[tuple(index)]
+        weights += weight * inside[tap:tap + size]
+    shape = [1] * arr.ndim
+    shape[axis] = size
+    return out / weights.reshape(shape)
+
+
+def gaussian_blur(arr, sigma=1.0, radius=None, border="shrink"):
+    """Gaussian blur
+
+    Separable Gaussian: one 1d pass along the rows and one along the columns,
+    so the cost per pixel grows with radius, not radius squared."""
+    kernel = gaussian_kernel(sigma, radius)
+    out = convolve_axis(arr, kernel, 0, border)
+    out = convolve_axis(out, kernel, 1, border)
+    return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+
+
+def median_filter(arr, radius=1, border="shrink"):
+    """Median
+
+    Replace each pixel with the median of the window around it; for even
+    window sizes (shrink border) the two middle values are averaged.
+
+    Works like Perreault's constant time median: one histogram per column
+    covers the rows of the current window and is updated by adding one row
+    and dropping another as the window moves down. The window histogram of
+    every pixel in the row is the difference of two prefix sums over those
+    column histograms, so the cost per pixel does not depend on the radius.
+    Histograms are two-level (16 coarse bins of 16 levels each): the coarse
+    one finds the bin holding the median, then only that bin's 16 fine
+    counts are looked at, and fine prefix sums are only built for the bins
+    and columns some window of the row needs."""
+    check_radius(radius)
+    check_border(border)
+    height, width = arr.shape[:2]
+    planes = arr.reshape(height, width, -1).transpose(2, 0, 1)
+    offset = 0
+    if border != "shrink":
+        planes = pad(planes.transpose(1, 2, 0), radius, border).transpose(2, 0, 1)
+        offset = radius
+    channels, rows, cols = planes.shape
+    y0, y1 = window_bounds(height, radius, offset, rows)
+    x0, x1 = window_bounds(width, radius, offset, cols)
+    dtype = np.uint16 if 2 * radius + 1 < 2 ** 16 else np.uint32
+    # The prefix sums add up the counts of all columns, which is more than
+    # the window holds: (2*radius+1) rows times the padded width.
+    prefix_dtype = np.uint32 if (2 * radius + 1) * cols < 2 ** 32 else np.uint64
+    # The fine histograms are stored bin by bin, (channels, 16, 16, cols), so
+    # the counts of one coarse bin are a slice.
+    fine = np.zeros((channels, 16, 16, cols), dtype=dtype)
+    coarse = np.zeros((channels, cols, 16), dtype=dtype)
+    coarse_prefix = np.zeros((channels, cols + 1, 16), dtype=prefix_dtype)
+    channel = np.arange(channels)[:, None]
+    column = np.arange(cols)[None, :]
+
+    def select(ranks, k, x):
+        """Return the k-th smallest value (k is (channels, len(x))) of the
+        windows of the output columns x, from their cumulative coarse counts"""
+        # The k-th smallest value lies in the first coarse bin whose
+        # cumulative count exceeds k ...
+        cbin = (ranks <= k[..., None]).sum(axis=2)
+        below = np.where(cbin > 0, np.take_along_axis(
+            ranks, np.maximum(cbin - 1, 0)[..., None], axis=2)[..., 0], 0)
+        # ... and within that bin it is the number of fine levels whose
+        # cumulative count is still <= k. Summing up the fine counts of all
+        # 256 levels over all columns would cost by far the most, so each
+        # coarse bin is only summed up over the columns of the windows that
+        # need it, and not at all if no window does.
+        counts = np.empty(cbin.shape + (16,), dtype=np.int64)
+        for b in np.flatnonzero(np.bincount(cbin.ravel(), minlength=16)):
+            c, i = np.nonzero(cbin == b)
+            left, right = x0[x[i]], x1[x[i]]
+            # The columns covered by those windows, and how many of them lie
+            # before every column.
+            used = np.cumsum(np.bincount(left, minlength=cols + 1)
+                             - np.bincount(right, minlength=cols + 1))[:-1] > 0
+            before = np.zeros(cols + 1, dtype=np.intp)
+            np.cumsum(used, out=before[1:])
+            prefix = np.zeros((channels, 16, before[-1] + 1), dtype=prefix_dtype)
+            np.cumsum(np.compress(used, fine[:, b], axis=2), axis=2,
+                      dtype=prefix_dtype, out=prefix[:, :, 1:])
+            # right > left, so the difference never wraps around.
+            counts[c, i] = prefix[c, :, before[right]] - prefix[c, :, before[left]]
+        fine_ranks = np.cumsum(counts, axis=2) + below[..., None]
+        return (cbin << 4) + (fine_ranks <= k[..., None]).sum(axis=2)
+
+    out = np.empty((channels, height, width), dtype=np.uint8)
+    every = np.arange(width)
+    top = bottom = 0
+    for y in range(height):
+        # Slide the column histograms down to rows y0[y]:y1[y].
+        for row in range(bottom, y1[y]):
+            fine[channel, planes[:, row] >> 4, planes[:, row] & 15, column] += 1
+            coarse[channel, column, planes[:, row] >> 4] += 1
+        for row in range(top, y0[y]):
+            fine[channel, planes[:, row] >> 4, planes[:, row] & 15, column] -= 1
+            coarse[channel, column, planes[:, row] >> 4] -= 1
+        top, bottom = y0[y], y1[y]
+        np.cumsum(coarse, axis=1, dtype=prefix_dtype, out=coarse_prefix[:, 1:])
+        ranks = np.cumsum(coarse_prefix[:, x1] - coarse_prefix[:, x0], axis=2,
+                          dtype=np.int64)
+        count = (y1[y] - y0[y]) * (x1 - x0)
+        low = select(ranks, np.broadcast_to((count - 1) // 2, (channels, width)),
+                     every)
+        high = low.copy()
+        # Windows of an even size (only with the shrink border) average the
+        # two middle values.
+        even = np.flatnonzero(count % 2 == 0)
+        if len(even):
+            high[:, even] = select(ranks[:, even], np.broadcast_to(
+                count[even] // 2, (channels, len(even))), even)
+        out[:, y] = (low + high) // 2
+    return out.transpose(1, 2, 0).reshape(arr.shape)
+
+
+# Each pixel's r+g+b can be 3*255=765 and the Sobel kernels weigh it with
+# at most +/-4, so |gx| and |gy| are <= 4*765=3060 and the gradient length
+# is <= sqrt(2*3060**2)=4328.
+SOBEL_SCALE = 4328.0
+SOBEL_OUTPUTS = ("magnitude", "direction")
+
+
+def sobel_planes(arr, border=None):
+    """Sobel gradients
+
+    Build the r+g+b intensity plane once and return a dict with the planes
+    gx, gy (int32), magnitude and direction (float64, radians from atan2).
+    border=None keeps the original behaviour of a one pixel frame without
+    gradients; any other mode of pad() computes the frame too."""
+    if border is not None:
+        check_border(border, tuple(_PAD_MODES))
+    plane = intensity(arr) if arr.ndim == 3 else arr.astype(np.int32)
+    p = pad(plane, 1, border or "nearest")
+    # The kernels are separable: smooth with (1, 2, 1) along one axis and
+    # take the central difference along the other.
+    smooth = p[:-2] + 2 * p[1:-1] + p[2:]
+    gx = smooth[:, 2:] - smooth[:, :-2]
+    diff = p[2:] - p[:-2]
+    gy = diff[:, :-2] + 2 * diff[:, 1:-1] + diff[:, 2:]
+    if border is None:
+        for g in (gx, gy):
+            g[0], g[-1], g[:, 0], g[:, -1] = 0, 0, 0, 0
+    return {"gx": gx, "gy": gy,
+            "magnitude": np.sqrt(gx.astype(np.int64) ** 2 + gy.astype(np.int64) ** 2),
+            "direction": np.arctan2(gy, gx)}
+
+
+def sobel_image(planes, scale=SOBEL_SCALE, output="magnitude"):
+    """Render sobel_planes as a grey RGB array.
+
+    The magnitude is normalised as length / scale * 255, scale="max" uses
+    the largest magnitude in the image instead of the theoretical 4328. The
+    direction maps -pi..pi to 0..255, pixels without gradient stay black."""
+    if output not in SOBEL_OUTPUTS:
+        raise ValueError("Unknown output %r, use one of %s" % (output, SOBEL_OUTPUTS))
+    magnitude = planes["magnitude"]
+    if output == "direction":
+        plane = (planes["direction"] + np.pi) / (2 * np.pi) * 255
+        plane[magnitude == 0] = 0
+    else:
+        if scale == "max":
+            scale = float(magnitude.max()) or 1.0
+        plane = magnitude / float(scale) * 255
+    return grey_planes(np.clip(np.trunc(plane), 0, 255))
+
+
+def sobel(arr, border=None, scale=SOBEL_SCALE, output="magnitude"):
+    "Outline the edges of the image, see sobel_planes and sobel_image"
+    return sobel_image(sobel_planes(arr, border), scale, output)
+
+
+## Resampling, see image_resample for the methods.
+# Output rows are computed in blocks of about this many values, which bounds
+# the float intermediates no matter how large the result is.
+RESIZE_BLOCK = 1 << 20
+
+
+def taps(src, dst, method):
+    """Return the (dst, taps) index and weight arrays that resample an axis,
+    from image_resample.weights. Outputs with fewer taps are padded with
+    their first index and weight 0."""
+    weights = image_resample.weights(src, dst, method)
+    count = max(len(pairs) for pairs in weights)
+    index = np.zeros((dst, count), dtype=np.intp)
+    weight = np.zeros((dst, count))
+    for i, pairs in enumerate(weights):
+        index[i] = pairs[0][0]
+        for k, (j, w) in enumerate(pairs):
+            index[i, k] = j
+            weight[i, k] = w
+    return index, weight
+
+
+def resize(arr, width, height, method="bilinear"):
+    """Resize to width x height. Nearest picks rows and columns by index,
+    the other methods gather the few source columns (then rows) every
+    output pixel depends on and add them up with their weights, in the same
+    order as image_resample.resize_rows, one block of output rows at a time."""
+    image_resample.check_method(method)
+    if method == "nearest":
+        rows = [pairs[0][0] for pairs in image_resample.weights(arr.shape[0], height, method)]
+        cols = [pairs[0][0] for pairs in image_resample.weights(arr.shape[1], width, method)]
+        return arr[rows][:, cols]
+    xindex, xweight = taps(arr.shape[1], width, method)
+    yindex, yweight = taps(arr.shape[0], height, method)
+    out = np.empty((height, width) + arr.shape[2:], dtype=np.uint8)
+    block = max(RESIZE_BLOCK // (width * 3), 1)
+    for top in range(0, height, block):
+        bottom = min(top + block, height)
+        # Resample only the source rows this block needs horizontally.
+        first = yindex[top:bottom].min()
+        last = yindex[top:bottom].max() + 1
+        src = arr[first:last]
+        rows = np.zeros((last - first, width) + arr.shape[2:])
+        for k in range(xindex.shape[1]):
+            rows += src[:, xindex[:, k]] * xweight[:, k, None]
+        acc = np.zeros((bottom - top, width) + arr.shape[2:])
+        for k in range(yindex.shape[1]):
+            acc += rows[yindex[top:bottom, k] - first] * yweight[top:bottom, k, None, None]
+        out[top:bottom] = np.minimum(np.floor(acc + 0.5), 255)
+    return out
+
+
+## Colour spaces. Vectorised versions of the colorsys functions: the
+# conversions take a uint8 RGB array and return float planes in colorsys'
+# ranges, the way back rounds to uint8. Results agree with colorsys applied
+# pixel by pixel to within one level.
+def rgb_planes(arr):
+    "Split an RGB array into float r, g, b planes in 0..1"
+    arr = arr / 255.0
+    return arr[..., 0], arr[..., 1], arr[..., 2]
+
+
+def to_rgb(r, g, b):
+    "Join float r, g, b planes in 0..1 into a rounded uint8 RGB array"
+    out = np.dstack((r, g, b)) * 255.0
+    return np.clip(np.floor(out + 0.5), 0, 255).astype(np.uint8)
+
+
+def hue_planes(r, g, b, maxc, rangec):
+    "The hue (0..1) shared by HSV and HLS, 0 where there is no colour"
+    grey = rangec == 0
+    rangec = np.where(grey, 1.0, rangec)
+    rc = (maxc - r) / rangec
+    gc = (maxc - g) / rangec
+    bc = (maxc - b) / rangec
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    return np.where(grey, 0.0, (h / 6.0) % 1.0)
+
+
+def rgb_to_hsv(arr):
+    "Return the h, s, v planes of an RGB array, see colorsys.rgb_to_hsv"
+    r, g, b = rgb_planes(arr)
+    maxc = np.maximum(np.maximum(r, g), b)
+    rangec = maxc - np.minimum(np.minimum(r, g), b)
+    s = np.where(maxc > 0, rangec / np.where(maxc > 0, maxc, 1.0), 0.0)
+    return hue_planes(r, g, b, maxc, rangec), s, maxc
+
+
+def hsv_to_rgb(h, s, v):
+    "Return the RGB array of h, s, v planes, see colorsys.hsv_to_rgb"
+    i = np.floor(h * 6.0)
+    f = h * 6.0 - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i.astype(np.int32) % 6
+    r = np.choose(i, (v, q, p, p, t, v))
+    g = np.choose(i, (t, v, v, q, p, p))
+    b = np.choose(i, (p, p, t, v, v, q))
+    return to_rgb(r, g, b)
+
+
+def rgb_to_hls(arr):
+    "Return the h, l, s planes of an RGB array, see colorsys.rgb_to_hls"
+    r, g, b = rgb_planes(arr)
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    sumc, rangec = maxc + minc, maxc - minc
+    l = sumc / 2.0
+    divisor = np.where(l <= 0.5, sumc, 2.0 - sumc)
+    s = np.where(rangec > 0, rangec / np.where(rangec > 0, divisor, 1.0), 0.0)
+    return hue_planes(r, g, b, maxc, rangec), l, s
+
+
+def hls_channel(m1, m2, h):
+    "One channel of hls_to_rgb for hue h, see colorsys._v"
+    h = h % 1.0
+    return np.where(h < 1/6.0, m1 + (m2 - m1) * h * 6.0,
+                    np.where(h < 0.5, m2,
+                             np.where(h < 2/3.0, m1 + (m2 - m1) * (2/3.0 - h) * 6.0, m1)))
+
+
+def hls_to_rgb(h, l, s):
+    "Return the RGB array of h, l, s planes, see colorsys.hls_to_rgb"
+    m2 = np.where(l <= 0.5, l * (1.0 + s), l + s - l * s)
+    m1 = 2.0 * l - m2
+    return to_rgb(hls_channel(m1, m2, h + 1/3.0), hls_channel(m1, m2, h),
+                  hls_channel(m1, m2, h - 1/3.0))
+
+
+def rgb_to_yiq(arr):
+    "Return the y, i, q planes of an RGB array, see colorsys.rgb_to_yiq"
+    r, g, b = rgb_planes(arr)
+    y = 0.30 * r + 0.59 * g + 0.11 * b
+    return y, 0.74 * (r - y) - 0.27 * (b - y), 0.48 * (r - y) + 0.41 * (b - y)
+
+
+def yiq_to_rgb(y, i, q):
+    "Return the RGB array of y, i, q planes, see colorsys.yiq_to_rgb"
+    return to_rgb(y + 0.9468822170900693 * i + 0.6235565819861433 * q,
+                  y - 0.27478764629897834 * i - 0.6356910791873801 * q,
+                  y - 1.1085450346420322 * i + 1.7090069284064666 * q)
+
+
+def saturation(arr, factor=1.0):
+    "Scale the HLS saturation of every pixel by factor"
+    h, l, s = rgb_to_hls(arr)
+    return hls_to_rgb(h, l, np.clip(s * factor, 0.0, 1.0))
+
+
+def lightness(arr, factor=1.0):
+    "Scale the HLS lightness of every pixel by factor"
+    h, l, s = rgb_to_hls(arr)
+    return hls_to_rgb(h, np.clip(l * factor, 0.0, 1.0), s)
+
+
+def hue(arr, degrees=0.0):
+    "Rotate the hue of every pixel by degrees"
+    h, s, v = rgb_to_hsv(arr)
+    return hsv_to_rgb((h + degrees / 360.0) % 1.0, s, v)
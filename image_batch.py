@@ -0,0 +1,220 @@
+""" Image Batch: run filter pipelines over many files on a pool of workers
+
+    Usage: python image_filter.py [-f FILTER ...] [-o OUTDIR] [options] INPUT ...
+
+    INPUTs are image files, directories (all images directly inside them) or
+    glob patterns. Every -f adds a filter to the pipeline, parameters follow
+    the name after a colon, e.g.
+
+        python image_filter.py -f greyscale -f average:radius=3,kernel=gaussian \\
+            -e array -j 8 -o out/ 'scans/*.png'
+
+    Files are processed on a process pool. Only a bounded number of files is
+    in flight at any time (--max-inflight), so memory stays flat no matter
+    how many inputs there are. Throughput and failures are reported at the end.
+    With --stream every file is processed strip by strip (see image_stream.py)
+    so even PPM and PNG images larger than memory go through (other formats
+    are decoded whole first); results are then written as PNG unless the
+    input is a PPM.
+"""
+
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from image_cache import ResultCache
+from image_filter import ENGINES, SUFFIXES
+from image_pipeline import Pipeline
+
+
+EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ppm", ".pgm", ".pnm", ".tif", ".tiff")
+
+
+def parse_value(value):
+    "Turn a parameter value from the command line into an int, float or str"
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_filter(spec):
+    "Parse 'name:key=value,key=value' into a (name, params) step"
+    name, _, args = spec.partition(":")
+    if name not in SUFFIXES:
+        raise argparse.ArgumentTypeError("unknown filter %r, use one of %s"
+                                         % (name, ", ".join(sorted(SUFFIXES))))
+    params = {}
+    for arg in filter(None, args.split(",")):
+        key, sep, value = arg.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError("bad parameter %r, use key=value" % arg)
+        params[key] = parse_value(value)
+    return (name, params)
+
+
+def find_inputs(patterns):
+    "Expand files, directories and globs into a sorted list of image files"
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            paths = glob.glob(pattern) or [pattern]
+        files.update(path for path in paths
+                     if os.path.splitext(path)[1].lower() in EXTENSIONS)
+    return sorted(files)
+
+
+def input_root(paths):
+    "The deepest directory all paths are in"
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+
+
+def output_path(path, pipeline, outdir=None, stream=False, root=None):
+    """Where the result for path goes: next to it or, with outdir, at its
+    place relative to root (default: its own directory) mirrored under
+    outdir, plus the suffix. Streamed results can only be PNG or PPM files."""
+    name, ext = os.path.splitext(path)
+    if outdir is not None:
+        directory = os.path.dirname(os.path.abspath(path))
+        relative = os.path.relpath(directory, root or directory)
+        name = os.path.normpath(os.path.join(outdir, relative, os.path.basename(name)))
+    if stream and ext.lower() != ".ppm":
+        ext = ".png"
+    return name + pipeline.suffix() + ext
+
+
+def process(path, steps, engine, out_file, cache_dir=None, cache_size=None,
+            stream=False, strip_rows=64):
+    """Worker: run the pipeline on one file, write the result to out_file and
+    return it and whether the result came from the cache"""
+    cache = None
+    if cache_dir is not None and not stream:
+        cache = ResultCache(cache_dir, cache_size)
+    pipeline = Pipeline(steps, engine=engine, cache=cache)
+    os.makedirs(os.path.dirname(out_file) or ".", exist_ok=True)
+    if stream:
+        pipeline.stream(path, out_file, strip_rows)
+    else:
+        pipeline.run(path, out_file)
+    return out_file, cache is not None and cache.hits > 0
+
+
+def run_batch(paths, steps, engine="pixel", outdir=None, workers=None,
+              max_inflight=None, report=None, cache_dir=None, cache_size=1 << 30,
+              stream=False, strip_rows=64):
+    """Process all paths and return (done, failures, seconds, cache hits)
+    where failures is a list of (path, error message). report(path, error)
+    is called after every file. Raises a ValueError before processing
+    anything if the steps are invalid or can't be streamed."""
+    workers = workers or os.cpu_count() or 1
+    max_inflight = max_inflight or 2 * workers
+    paths = list(paths)
+    pipeline = Pipeline(steps, engine=engine)
+    if stream:
+        # Steps that can't stream would fail every file, so fail before any.
+        pipeline.check_stream()
+    root = input_root(paths) if outdir is not None and paths else None
+    done, hits, failures = 0, 0, []
+    start = time.time()
+    # Inputs whose results would overwrite an earlier one's fail up front.
+    outputs, todo = {}, []
+    for path in paths:
+        out_file = output_path(path, pipeline, outdir, stream, root)
+        key = os.path.normcase(os.path.abspath(out_file))
+        if key in outputs:
+            error = "ValueError: %s would overwrite the result of %s" % (out_file, outputs[key])
+            failures.append((path, error))
+            if report is not None:
+                report(path, error)
+            continue
+        outputs[key] = path
+        todo.append((path, out_file))
+    pending = {}
+    todo = iter(todo)
+    with ProcessPoolExecutor(workers) as pool:
+        while True:
+            # Keep at most max_inflight files decoded or queued at once.
+            for path, out_file in todo:
+                pending[pool.submit(process, path, steps, engine, out_file,
+                                    cache_dir, cache_size, stream,
+                                    strip_rows)] = path
+                if len(pending) >= max_inflight:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for job in finished:
+                path = pending.pop(job)
+                error = job.exception()
+                if error is None:
+                    done += 1
+                    hits += job.result()[1]
+                else:
+                    failures.append((path, "%s: %s" % (type(error).__name__, error)))
+                if report is not None:
+                    report(path, error)
+    return done, failures, time.time() - start, hits
+
+
+def main(argv=None):
+    "Command line entry point, returns the exit status"
+    parser = argparse.ArgumentParser(
+        description="Apply image filters to many files at once.")
+    parser.add_argument("inputs", nargs="*", default=["example.png"],
+                        help="image files, directories or glob patterns")
+    parser.add_argument("-f", "--filter", dest="filters", action="append",
+                        type=parse_filter, metavar="NAME[:KEY=VALUE,...]",
+                        help="add a filter to the pipeline (default: sobel)")
+    parser.add_argument("-o", "--outdir", help="write results here instead "
+                        "of next to the inputs, mirroring their subdirectories")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="pixel")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--max-inflight", type=int, default=None,
+                        help="files in flight at once (default: 2 per worker)")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse results stored in this cache directory")
+    parser.add_argument("--cache-size", type=int, default=1024, metavar="MB",
+                        help="evict the least recently used results above "
+                        "this size (default: 1024)")
+    parser.add_argument("--stream", action="store_true",
+                        help="process images strip by strip to keep memory "
+                        "flat (PPM and PNG inputs, others are decoded whole), "
+                        "needs NumPy and ignores --cache")
+    parser.add_argument("--strip-rows", type=int, default=64, metavar="ROWS",
+                        help="rows per strip with --stream (default: 64)")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only print the summary")
+    args = parser.parse_args(argv)
+    steps = args.filters or [("sobel", {})]
+    paths = find_inputs(args.inputs)
+    if not paths:
+        parser.error("no images found in %s" % " ".join(args.inputs))
+
+    def report(path, error):
+        if error is not None:
+            print("FAILED %s: %s" % (path, error), file=sys.stderr)
+        elif not args.quiet:
+            print("done   %s" % path)
+
+    try:
+        done, failures, seconds, hits = run_batch(
+            paths, steps, args.engine, args.outdir, args.workers, args.max_inflight,
+            report, args.cache, args.cache_size << 20, args.stream, args.strip_rows)
+    except ValueError as error:
+        parser.error(str(error))
+    print("%d images in %.2fs (%.2f images/sec), %d failed"
+          % (done, seconds, done / seconds if seconds else 0.0, len(failures)))
+    if args.cache and not args.stream:
+        print("cache: %d hits, %d misses" % (hits, done - hits))
+    for path, error in failures:
+        print("  %s: %s" % (path, error))
+    return 1 if failures else 0
@@ -0,0 +1,237 @@
+""" Image Bench: benchmark every ImageFilter method across image sizes
+
+    Usage: python image_bench.py [-s WxH ...] [-f FILTER ...] [-e ENGINE ...]
+                                 [-o results.json] [--baseline old.json]
+
+    Runs every filter on synthetic images of several sizes plus example.png,
+    once per engine, and reports megapixels per second, peak memory and how
+    the time splits into decode (loading the image), compute (the filter)
+    and write (encoding and saving the result). Every case runs in a fresh
+    process so peak memory and caches don't leak from one case to the next.
+
+    Results can be saved as JSON. Given a baseline (the JSON of an earlier
+    run), every case is compared to it and the exit status is 1 if any of
+    them got slower by more than --threshold, so an optimisation can be
+    proven and a regression caught:
+
+        python image_bench.py -o before.json
+        ... change a filter ...
+        python image_bench.py --baseline before.json
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import cImage as image
+from image_filter import ENGINES, SUFFIXES, ImageFilter, load_array_engine
+
+
+SIZES = ("64x48", "320x240")
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example.png")
+# Parameters for the filters that have no useful defaults.
+PARAMS = {"resize": {"scale": 0.5}}
+# Cases faster than this (in seconds) are too noisy to count as regressions.
+MIN_TIME = 0.01
+
+
+def parse_size(size):
+    "Parse 'WIDTHxHEIGHT' into a (width, height) tuple"
+    try:
+        width, height = [int(n) for n in size.lower().split("x")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("bad size %r, use WIDTHxHEIGHT" % size)
+    return width, height
+
+
+def synthetic(filename, width, height):
+    """Write a reproducible test image: red and green ramps and a blue
+    xor pattern, so there are both smooth areas and sharp edges"""
+    data = bytearray(width * height * 3)
+    i = 0
+    for y in range(height):
+        for x in range(width):
+            data[i] = x * 255 // max(width - 1, 1)
+            data[i+1] = y * 255 // max(height - 1, 1)
+            data[i+2] = (x ^ y) & 255
+            i += 3
+    img = image.EmptyImage(width, height)
+    img.setRegion(0, 0, width, height, data)
+    img.save(filename)
+
+
+def peak_memory():
+    "The peak resident memory of this process in bytes"
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(case):
+    "Worker: run one filter on one image and return the measurements"
+    name, engine, img_file = case
+    start_memory = peak_memory()
+    start = time.perf_counter()
+    img = ImageFilter(img_file, draw=0, engine=engine, autowrite=0)
+    decoded = time.perf_counter()
+    getattr(img, name)(**PARAMS.get(name, {}))
+    computed = time.perf_counter()
+    img.write(SUFFIXES[name])
+    written = time.perf_counter()
+    megapixels = img.oldimg.getWidth() * img.oldimg.getHeight() / 1e6
+    compute = computed - decoded
+    return {
+        "filter": name,
+        "engine": engine,
+        "image": os.path.basename(img_file),
+        "width": img.oldimg.getWidth(),
+        "height": img.oldimg.getHeight(),
+        "decode": decoded - start,
+        "compute": compute,
+        "write": written - computed,
+        "total": written - start,
+        "mp_per_sec": megapixels / compute if compute else 0.0,
+        "peak_bytes": max(peak_memory() - start_memory, 0),
+    }
+
+
+def best(runs):
+    "Combine repeated runs of a case, keeping the fastest of each phase"
+    result = dict(runs[0])
+    for key in ("decode", "compute", "write", "total"):
+        result[key] = min(run[key] for run in runs)
+    result["mp_per_sec"] = max(run["mp_per_sec"] for run in runs)
+    result["peak_bytes"] = max(run["peak_bytes"] for run in runs)
+    return result
+
+
+def case_key(result):
+    "What identifies a case when comparing against a baseline"
+    return (result["filter"], result["engine"], result["image"])
+
+
+def compare(results, baseline, threshold):
+    """Return a list of (result, old compute time, ratio) for every case
+    that is slower than in baseline by more than threshold (0.1 = 10%)"""
+    old = dict((case_key(result), result) for result in baseline["results"])
+    regressions = []
+    for result in results:
+        before = old.get(case_key(result))
+        if before is None or max(result["compute"], before["compute"]) < MIN_TIME:
+            continue
+        ratio = result["compute"] / before["compute"] if before["compute"] else float("inf")
+        if ratio > 1 + threshold:
+            regressions.append((result, before["compute"], ratio))
+    return regressions
+
+
+def run_bench(filters, engines, images, repeat=1, report=None):
+    """Run every filter with every engine on every image file, each case
+    repeat times in a fresh process, and return the list of results"""
+    cases = [(name, engine, img_file) for img_file in images
+             for engine in engines for name in filters]
+    results = []
+    # One process per run: peak memory and warm caches stay with their case.
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for case in cases:
+            runs = list(pool.imap(run_case, [case] * repeat))
+            result = best(runs)
+            results.append(result)
+            if report is not None:
+                report(result)
+    return results
+
+
+def print_result(result):
+    print("%-12s %-6s %-16s %7.3f %8.3f %8.3f %8.3f %9.3f %8.1f"
+          % (result["filter"], result["engine"], result["image"],
+             result["width"] * result["height"] / 1e6, result["decode"],
+             result["compute"], result["write"], result["mp_per_sec"],
+             result["peak_bytes"] / 1048576.0))
+
+
+def main(argv=None):
+    "Command line entry point, returns the exit status"
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ImageFilter methods.")
+    parser.add_argument("-s", "--size", dest="sizes", action="append",
+                        type=parse_size, metavar="WxH",
+                        help="add a synthetic image size (default: %s)"
+                        % ", ".join(SIZES))
+    parser.add_argument("--no-example", action="store_true",
+                        help="skip example.png")
+    parser.add_argument("-f", "--filter", dest="filters", action="append",
+                        choices=sorted(SUFFIXES), metavar="FILTER",
+                        help="benchmark only these filters (default: all)")
+    parser.add_argument("-e", "--engine", dest="engines", action="append",
+                        choices=ENGINES,
+                        help="benchmark only these engines (default: all "
+                        "that are installed)")
+    parser.add_argument("-r", "--repeat", type=int, default=1,
+                        help="run every case this often, keep the best (default: 1)")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="save the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare against the JSON of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fail if compute time grew by more than this "
+                        "fraction over the baseline (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    engines = args.engines
+    if engines is None:
+        engines = list(ENGINES)
+        try:
+            load_array_engine()
+        except ValueError:
+            engines.remove("array")
+    filters = args.filters or sorted(SUFFIXES)
+    sizes = args.sizes or [parse_size(size) for size in SIZES]
+
+    workdir = tempfile.mkdtemp(prefix="image_bench")
+    try:
+        images = []
+        for width, height in sizes:
+            img_file = os.path.join(workdir, "synthetic_%dx%d.png" % (width, height))
+            synthetic(img_file, width, height)
+            images.append(img_file)
+        if not args.no_example:
+            # Copied, so results are written to the scratch directory.
+            images.append(shutil.copy(EXAMPLE, workdir))
+        print("%-12s %-6s %-16s %7s %8s %8s %8s %9s %8s"
+              % ("filter", "engine", "image", "MP", "decode", "compute",
+                 "write", "MP/s", "peak MB"))
+        results = run_bench(filters, engines, images, args.repeat, print_result)
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for result, before, ratio in regressions:
+            print("REGRESSION %s/%s on %s: %.3fs -> %.3fs (%+.0f%%)"
+                  % (result["filter"], result["engine"], result["image"],
+                     before, result["compute"], (ratio - 1) * 100))
+        if regressions:
+            return 1
+        print("No regressions against %s" % args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+""" Image Cache: content-addressed on-disk cache for filter results
+
+    Results are stored as encoded files under a key that hashes everything
+    that decides the output: the input pixels and size, the filter name, its
+    parameters, the engine and ENGINE_VERSION. The same image run through the
+    same filter again is a lookup instead of a decode, filter run and encode.
+
+    The cache directory is bounded by max_bytes; the least recently used
+    entries (by file mtime, which every hit refreshes) are evicted first.
+    Several processes may share one directory.
+"""
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+# Bump this whenever a filter's output changes for the same input, so stale
+# results are never served.
+ENGINE_VERSION = "2"
+
+# Entries are stored in the output format when it is lossless, so a hit can
+# be copied to the output file as is. Anything else is stored as PNG.
+LOSSLESS = (".png", ".ppm", ".pgm", ".bmp", ".tif", ".tiff")
+
+# Entries are written to a temporary file first, named with this prefix so
+# other processes sharing the directory leave it alone until it is complete.
+TMP_PREFIX = ".tmp-"
+
+
+def storage_ext(ext):
+    "The extension entries for an output with extension ext are stored with"
+    ext = ext.lower()
+    if ext in LOSSLESS:
+        return ext
+    return ".png"
+
+
+class ResultCache(object):
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        "Use (and create) directory, keeping it below max_bytes"
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, img, name, params, engine="pixel", ext=".png"):
+        """Return the key of filter name with params applied to the cImage
+        image img by engine, for an output file with extension ext"""
+        ext = storage_ext(ext)
+        digest = hashlib.sha256()
+        header = "%s|%s|%s|%r|%s|%dx%d|" % (ENGINE_VERSION, engine, name,
+                                          sorted(params.items()), ext,
+                                          img.getWidth(), img.getHeight())
+        digest.update(header.encode("utf-8"))
+        digest.update(img.getRegion(0, 0, img.getWidth(), img.getHeight()))
+        return digest.hexdigest() + ext
+
+    def path(self, key):
+        "The file an entry is stored in"
+        return os.path.join(self.directory, key)
+
+    def get(self, key, load=None):
+        """Return the path of the stored result for key, or None on a miss.
+        load(path) is called before a hit is counted; if it raises an OSError
+        (e.g. the entry was evicted by another process in between) that is
+        a miss, too."""
+        path = self.path(key)
+        try:
+            # Refresh the mtime: it is the "last used" stamp for eviction.
+            os.utime(path, None)
+            if load is not None:
+                load(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key, img=None, filename=None):
+        """Store a result, either a cImage image (encoded here) or an already
+        encoded file, and return the path of the entry. Results larger than
+        max_bytes are not stored, then None is returned."""
+        path = self.path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=TMP_PREFIX,
+                                   suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            if filename is not None:
+                shutil.copyfile(filename, tmp)
+            else:
+                img.save(tmp, strict=True)
+            # Atomic, so concurrent readers never see a half written entry.
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                # Don't hide the error that got us here.
+                pass
+            raise
+        try:
+            if os.path.getsize(path) > self.max_bytes:
+                os.unlink(path)
+                return None
+        except OSError:
+            # Already evicted by another process sharing the directory.
+            return None
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        """Return (mtime, size, path) of every stored entry, without the
+        temporary files of results still being written"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(TMP_PREFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # Evicted by another process since scandir().
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        "Return the number of bytes in the cache"
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries until we are below
+        max_bytes, but never the entry at path keep (the one just stored)"""
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        "Return the counters and the size as a dict"
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "bytes": self.size(),
+                "max_bytes": self.max_bytes}
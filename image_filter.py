@@ -1,4 +1,4 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 
 """ Image Filter: Image Processing with PIL and cImage
 
@@ -11,48 +11,328 @@
     invert - Inverts all pixels in the given image.
     greyscale - Turns picture into a grey version by averaging each pixels RBG values.
     blackwhite - Creates a black and white version of the given image.
-    removecolor - Removes one color (currently only red) from the picture.
+    removecolor - Removes one color or a combination (R, G, B, RG, ...) from the picture.
     sepia - Applies the sepia filter to the given image.
+    luminance, mixer - Greyscale weighted by brightness and a channel mixer.
+        Like sepia they are colour matrices in fixed point, see image_matrix.py.
+    threshold, gamma, levels, contrast - Tone operations per channel.
+    saturation, lightness, hue - Adjustments in the HLS and HSV colour spaces.
     double - Doubles the size of the image.
-    average - Smoothes out the image by averaging the 8 neighbors of a pixel.
+    resize, thumbnail - Scale the image by any factor (nearest, bilinear or area
+        averaging). ImageFilter(..., draft=(size, size)) decodes JPEGs at a
+        reduced size for thumbnails; Pipeline and FanOut pass it when every
+        recipe starts with a thumbnail.
+    average - Smoothes out the image by averaging the neighbors of a pixel
+        (box or gaussian kernel, any radius).
     median - Same thing as average but using a median. Likely gives better results.
+        Any radius, constant time per pixel on the array engine.
     sobel - Outlines the edges in the picture white, everything else gets dark. Looks cool!
+        The array engine can also return the gradient planes.
 
     Please note that this was a learning exercise. Do not use these filters with
     large images as the execution time is O(n) or worse.
+
+    invert, removecolor, blackwhite's threshold and the tone operations compile
+    into 256-entry lookup tables per channel (image_lut.py). Consecutive tables
+    are composed into one and applied to the whole image in a single pass.
+
+    Engines:
+    pixel - The default. Loops over every pixel with getPixel/setPixel.
+    array - Runs the filters on a whole NumPy array in batched passes, adds
+        border modes and gaussian kernels. Requires NumPy, see image_array.py.
+        With workers > 1 the neighborhood filters (average, median, sobel) run
+        in tiles on a process pool, see image_tiles.py.
     
     TODO:
-    1. Use colorsys to add HLS, HSV, YIQ compatibility and customization (satu-
-    ration, (r+g+b), lightness)
+    1. Done: saturation(), lightness() and hue() use colorsys, the array engine
+    converts whole planes at once (image_array.rgb_to_hls etc.).
     2. Write testcases
     3. Add file type conversion
-    4. Add command line arguments
-    5. Add resizing and thumbnail methods
-    6. Use gaussian kernel for average() instead of averaging.
-        Also source out the neighborhood stuff to a separate method.
-    7. Make the write method optional.
+    4. Done: command line arguments and batch processing, see image_batch.py.
+    5. Done: resize() and thumbnail(), see image_resample.py.
+    6. Done: average() takes a radius and a gaussian kernel, the neighborhood
+        stuff lives in neighbors() and image_array.py.
+    7. Done: autowrite=0 skips writing, see image_pipeline.py.
     8. Implement the skip_draw argument properly (per method, not instance).
-    9. Fix instance initialisation (make them reusable).
+    9. Done: reset() makes instances reusable, see FanOut in image_pipeline.py.
     10. Use empty canvases for everything, skip .copy() for self.newimg.
     11. Empty or 300 lines :o)
 """
 
 
 import cImage as image
+import colorsys
+import image_lut
+import image_matrix
+import image_resample
+import inspect
+import os
+import shutil
+from contextlib import nullcontext
+from functools import partial, wraps
 from math import sqrt
 from os.path import splitext
 
+# The array engine is optional and only available if NumPy is installed.
+# Its modules are imported on first use to keep importing image_filter fast.
+image_array = image_tiles = None
+
+def load_array_engine():
+    "Import the modules of the array engine, raise a ValueError without NumPy"
+    global image_array, image_tiles
+    if image_array is None:
+        try:
+            import image_array
+            import image_tiles
+        except ImportError:
+            raise ValueError("The array engine requires NumPy")
+
+ENGINES = ("pixel", "array")
+KERNELS = ("box", "gaussian")
+
+
+## Point operations, used by apply_point(). Each point filter compiles to
+# a list of steps: ("lut", name of an image_lut table builder) for tone
+# operations that work on every channel on its own, ("matrix", name of an
+# image_matrix builder) for weighted sums of the channels, or ("pixel", pixel
+# function, name of the image_array function) for anything else.
+def greyscale_pixel(p):
+    "For each pixel p get the RBG values and average them out."
+    avg = (p[0]+p[1]+p[2])//3
+    p.red = p.green = p.blue = avg
+    return p
+
+def to_level(value):
+    "Turn a colorsys value in 0..1 back into a channel value in 0..255"
+    return min(max(int(value * 255.0 + 0.5), 0), 255)
+
+def saturation_pixel(p, factor=1.0):
+    "Scale the HLS saturation of pixel p by factor"
+    h, l, s = colorsys.rgb_to_hls(p.red/255.0, p.green/255.0, p.blue/255.0)
+    r, g, b = colorsys.hls_to_rgb(h, l, min(max(s*factor, 0.0), 1.0))
+    p.red, p.green, p.blue = to_level(r), to_level(g), to_level(b)
+    return p
+
+def lightness_pixel(p, factor=1.0):
+    "Scale the HLS lightness of pixel p by factor"
+    h, l, s = colorsys.rgb_to_hls(p.red/255.0, p.green/255.0, p.blue/255.0)
+    r, g, b = colorsys.hls_to_rgb(h, min(max(l*factor, 0.0), 1.0), s)
+    p.red, p.green, p.blue = to_level(r), to_level(g), to_level(b)
+    return p
+
+def hue_pixel(p, degrees=0.0):
+    "Rotate the hue of pixel p by degrees"
+    h, s, v = colorsys.rgb_to_hsv(p.red/255.0, p.green/255.0, p.blue/255.0)
+    r, g, b = colorsys.hsv_to_rgb((h + degrees/360.0) % 1.0, s, v)
+    p.red, p.green, p.blue = to_level(r), to_level(g), to_level(b)
+    return p
+
+POINT_OPS = {
+    "invert": [("lut", "invert")],
+    "greyscale": [("pixel", greyscale_pixel, "greyscale")],
+    # Any pixel with an average r+g+b of >= 128 gets converted to white (255),
+    # all others to black (0).
+    "blackwhite": [("pixel", greyscale_pixel, "greyscale"), ("lut", "threshold")],
+    "removecolor": [("lut", "removecolor")],
+    "sepia": [("matrix", "sepia")],
+    "luminance": [("matrix", "luminance")],
+    "mixer": [("matrix", "mixer")],
+    "threshold": [("lut", "threshold")],
+    "gamma": [("lut", "gamma")],
+    "levels": [("lut", "levels")],
+    "contrast": [("lut", "contrast")],
+    "saturation": [("pixel", saturation_pixel, "saturation")],
+    "lightness": [("pixel", lightness_pixel, "lightness")],
+    "hue": [("pixel", hue_pixel, "hue")],
+}
+
+def point_ops(name, **params):
+    """Compile a point filter into a list of ("lut", table) and
+    ("pixel", pixel function, array function) operations. The array
+    functions are None until the array engine is loaded."""
+    ops = []
+    for step in POINT_OPS[name]:
+        if step[0] == "lut":
+            ops.append(("lut", getattr(image_lut, step[1])(**params)))
+            continue
+        if step[0] == "matrix":
+            matrix = getattr(image_matrix, step[1])(**params)
+            array_func = None
+            if image_array is not None:
+                array_func = partial(image_array.apply_matrix, matrix=matrix)
+            ops.append(("pixel", partial(image_matrix.apply_pixel, matrix=matrix),
+                        array_func))
+            continue
+        kind, pixel_func, array_name = step
+        array_func = None
+        if image_array is not None:
+            array_func = partial(getattr(image_array, array_name), **params)
+        ops.append(("pixel", partial(pixel_func, **params), array_func))
+    return ops
+
+
+## Neighborhood filters of the array engine, shared with image_stream. Each
+# takes the filter's parameters, checks them and returns the image_array
+# function to run, its arguments after the array and its radius (halo).
+def check_kernel(kernel):
+    "Raise a ValueError for unknown average() kernels"
+    if kernel not in KERNELS:
+        raise ValueError("Unknown kernel %r, use one of %s" % (kernel, KERNELS))
+
+def average_window(radius=1, kernel="box", sigma=None, border="shrink"):
+    "See ImageFilter.average"
+    check_kernel(kernel)
+    image_array.check_radius(radius)
+    image_array.check_border(border)
+    if kernel == "gaussian":
+        sigma = sigma or max(radius, 1) / 2.0
+        return image_array.gaussian_blur, (sigma, radius, border), radius
+    return image_array.box_blur, (radius, border), radius
+
+def median_window(radius=1, border="shrink"):
+    "See ImageFilter.median"
+    image_array.check_radius(radius)
+    image_array.check_border(border)
+    return image_array.median_filter, (radius, border), radius
+
+def sobel_window(draw=0, border=None, scale=4328.0, output="magnitude",
+                 gradients=False):
+    "See ImageFilter.sobel"
+    if gradients or scale == "max":
+        raise ValueError("Sobel with gradients or scale='max' needs the whole image")
+    if border is not None:
+        image_array.check_border(border)
+    if output not in image_array.SOBEL_OUTPUTS:
+        raise ValueError("Unknown output %r, use one of %s"
+                         % (output, image_array.SOBEL_OUTPUTS))
+    return image_array.sobel, (border, scale, output), 1
+
+WINDOWS = {
+    "average": average_window,
+    "median": median_window,
+    "sobel": sobel_window,
+}
+
+# The filename suffix every filter writes its result with.
+SUFFIXES = {
+    "invert": "_inv",
+    "greyscale": "_grey",
+    "blackwhite": "_bw",
+    "removecolor": "_rc",
+    "sepia": "_sepia",
+    "luminance": "_lum",
+    "mixer": "_mix",
+    "threshold": "_thr",
+    "gamma": "_gamma",
+    "levels": "_levels",
+    "contrast": "_contrast",
+    "saturation": "_sat",
+    "lightness": "_light",
+    "hue": "_hue",
+    "double": "_double",
+    "resize": "_resize",
+    "thumbnail": "_thumb",
+    "average": "_avg",
+    "median": "_median",
+    "sobel": "_sobel",
+}
+
+
+def region_halo(name, params):
+    """Return how many pixels around a region filter name (with params) reads
+    from, see ImageFilter.apply_region. Raises a ValueError for filters that
+    change the size of the image or need all of it."""
+    if name not in SUFFIXES:
+        raise ValueError("Unknown filter %r, use one of %s" % (name, sorted(SUFFIXES)))
+    if name in POINT_OPS:
+        return 0
+    if name in ("average", "median"):
+        return params.get("radius", 1)
+    if name == "sobel" and not params.get("gradients") and params.get("scale") != "max":
+        return 1
+    raise ValueError("%s can't be applied to a region of the image" % name)
+
+
+def cached(method):
+    """Decorator for filter methods. Times the filter as a phase of its own
+    (see ImageFilter.phase) and writes the result afterwards. With a
+    ResultCache (see image_cache) the result is looked up before the filter
+    runs and stored afterwards; a hit loads the stored image instead of
+    running the filter and write() copies the stored file instead of encoding
+    it again."""
+    name = method.__name__
+    signature = inspect.signature(method)
+    @wraps(method)
+    def run(self, *args, **kwargs):
+        key = None
+        if self.cache is not None:
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            del params["self"]
+            params.pop("draw", None)
+            # Gradient planes can't be stored, those runs always compute.
+            if not params.get("gradients"):
+                key = self.cache.key(self.newimg, name, params, self.engine,
+                                     self.strip_name()[1])
+
+        def compute():
+            # Write after the phase, so encoding isn't counted as filtering.
+            autowrite, self.autowrite = self.autowrite, 0
+            try:
+                with self.phase(name):
+                    return method(self, *args, **kwargs)
+            finally:
+                self.autowrite = autowrite
+                # Shared intermediates belong to the input we just replaced.
+                self.shared = None
+        result = self.cached_result(key, compute)
+        # double doesn't draw its result, see there.
+        self.finish(SUFFIXES[name], name != "double")
+        return result
+    return run
+
+
 class ImageFilter(object):
 
-    def __init__(self, img_file, draw=1):
+    def __init__(self, img_file, draw=1, engine="pixel", workers=1, tile_size=512,
+                 autowrite=1, cache=None, stats=None, draft=None):
         "Initialize image, clone it, get its size and create a canvas"
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine %r, use one of %s" % (engine, ENGINES))
+        if engine == "array":
+            load_array_engine()
+        if workers != 1 and engine != "array":
+            raise ValueError("Multiple workers need engine='array'")
+        # Decides whether filters loop over Pixels or work on a NumPy array.
+        self.engine = engine
+        # Neighborhood filters of the array engine run in tiles on a process
+        # pool when workers is > 1 (None means one per CPU).
+        self.workers = workers
+        self.tile_size = tile_size
         self.img_file = img_file
-        self.oldimg = image.Image(self.img_file)
+        # An optional cImage.Stats that records the time of every phase and
+        # counts the pixel calls of our images, see phase().
+        self.stats = stats
+        # For JPEGs, a (width, height) to decode at a reduced size of at least
+        # that much instead of the full size, see thumbnail().
+        with self.phase("decode"):
+            self.oldimg = self.load_image(self.img_file, draft)
         self.width = self.oldimg.getWidth()
         self.height = self.oldimg.getHeight()
-        self.newimg = self.oldimg.copy()
+        with self.phase("copy"):
+            self.newimg = self.oldimg.copy()
         # Decides whether to skip drawing the image in a popup window.
         self.draw = draw
+        # Decides whether every filter writes its result right away.
+        self.autowrite = autowrite
+        # An optional image_cache.ResultCache, and the cache entry holding
+        # the current newimg if it came from (or went to) the cache.
+        self.cache = cache
+        self.cached_file = None
+        # Intermediates shared by filters that run on the same input, filled
+        # in by the first one that needs them (see intensity() and FanOut).
+        self.shared = None
         if self.draw:
             self.win = image.ImageWin(self.img_file, self.width, self.height)
 
@@ -60,240 +340,518 @@ class ImageFilter(object):
         "Draw and save a processed image"
         # Get file's root and extension from method strip_name().
         img_name, img_ext = self.strip_name()
-        self.newimg.save(img_name+func_name+img_ext)
+        self.save(img_name+func_name+img_ext)
         # Again, only execute this if we want to have a popup of the window.
         if self.draw:
-            self.newimg.draw(self.win)
+            with self.phase("draw"):
+                self.newimg.draw(self.win)
             self.win.exitonclick()
 
+    def save(self, filename):
+        "Save the processed image to filename"
+        with self.phase("write"):
+            # If the cache holds newimg in our format, copy it instead of encoding.
+            if self.cached_file and splitext(self.cached_file)[1] == splitext(filename)[1].lower():
+                try:
+                    shutil.copyfile(self.cached_file, filename)
+                except FileNotFoundError:
+                    # Evicted meanwhile, newimg holds the same pixels.
+                    self.cached_file = None
+                else:
+                    if self.stats is not None:
+                        self.stats.count("bytes_written", os.path.getsize(filename))
+                    return
+            self.newimg.save(filename, strict=True)
+
+    def phase(self, name):
+        """Return a context manager that times its body as phase name in
+        self.stats, or does nothing without stats"""
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.phase(name)
+
+    def load_image(self, filename, draft=None):
+        "Load an image file, instrumented if we have stats"
+        img = image.Image(filename, draft)
+        if self.stats is not None:
+            img.instrument(self.stats)
+        return img
+
+    def load_result(self, path):
+        """Replace self.newimg with the result stored at path by a ResultCache.
+        Raises an OSError if the entry is gone."""
+        self.newimg = self.load_image(path)
+        self.width = self.newimg.getWidth()
+        self.height = self.newimg.getHeight()
+        self.cached_file = path
+        self.shared = None
+
+    def cached_result(self, key, compute, cache=None):
+        """Load the result stored under key in cache (default: self.cache)
+        into self.newimg, or on a miss run compute() and store the image it
+        leaves there. No key skips the cache. Sets self.cached_file to the
+        stored entry (see save()) and returns what compute() returned, None
+        on a hit."""
+        cache = cache or self.cache
+        self.cached_file = None
+        if key is not None and cache.get(key, self.load_result) is not None:
+            return None
+        result = compute()
+        if key is not None:
+            self.cached_file = cache.put(key, self.newimg)
+        return result
+
+    def new_image(self, width, height):
+        "Return an empty image, instrumented if we have stats"
+        img = image.EmptyImage(width, height)
+        if self.stats is not None:
+            img.instrument(self.stats)
+        return img
+
+    def reset(self, source=None):
+        """Start over from a copy of source (default: the original image), so
+        the instance can be reused"""
+        if source is None:
+            source = self.oldimg
+        self.newimg = source.copy()
+        self.width = source.getWidth()
+        self.height = source.getHeight()
+        self.cached_file = None
+        self.shared = None
+
+    def intensity(self, arr):
+        """Return the r+g+b plane of arr, the current image as an array. With
+        self.shared it is computed only once for all filters sharing it."""
+        if self.shared is None:
+            return image_array.intensity(arr)
+        if "intensity" not in self.shared:
+            self.shared["intensity"] = image_array.intensity(arr)
+        return self.shared["intensity"]
+
+    def apply_region(self, name, box, **params):
+        """Recompute the filter name (with params) after the rectangle box =
+        (x, y, width, height) of self.oldimg was retouched, instead of running
+        it on the whole image again. A change there affects the result up to
+        the radius of the filter's neighborhood (see region_halo) around the
+        box, so that much is patched into self.newimg, computed from twice as
+        much of the source. If we draw, only the patch is redrawn. As with
+        image_tiles, the result is identical to filtering the whole image."""
+        halo = region_halo(name, params)
+        width, height = self.oldimg.getWidth(), self.oldimg.getHeight()
+        if (self.newimg.getWidth(), self.newimg.getHeight()) != (width, height):
+            raise ValueError("The result no longer has the size of the original image")
+        x, y, w, h = box
+        self.oldimg.checkRegion(x, y, w, h)
+        # The patch, and the part of the source it is computed from.
+        x, y = max(x - halo, 0), max(y - halo, 0)
+        w, h = min(box[0] + w + halo, width) - x, min(box[1] + h + halo, height) - y
+        left, top = max(x - halo, 0), max(y - halo, 0)
+        right, bottom = min(x + w + halo, width), min(y + h + halo, height)
+        part = self.new_image(right - left, bottom - top)
+        part.setRegion(0, 0, right - left, bottom - top,
+                       self.oldimg.getRegion(left, top, right - left, bottom - top))
+        # Run the filter itself, not its cached wrapper, on the part alone.
+        params.pop("draw", None)
+        newimg, state = self.newimg, (self.autowrite, self.draw)
+        self.reset(part)
+        self.autowrite = 0
+        try:
+            with self.phase(name):
+                getattr(ImageFilter, name).__wrapped__(self, **params)
+            part = self.newimg
+        finally:
+            self.newimg, self.width, self.height = newimg, width, height
+            self.autowrite, self.draw = state
+            # Neither the cache entry nor shared intermediates match anymore.
+            self.cached_file = self.shared = None
+        self.newimg.setRegion(x, y, w, h, part.getRegion(x - left, y - top, w, h))
+        if self.draw:
+            with self.phase("draw"):
+                self.newimg.drawRegion(self.win, x, y, w, h)
+
     def strip_name(self):
         "Strips the name of a file into (pathname, extension)"
         return splitext(self.img_file)
 
+    def run_array(self, func, arr, *args, halo=None):
+        """Return func(arr, *args). Neighborhood filters pass the radius of
+        their neighborhood as halo and are split into tiles if we have workers."""
+        if halo is None or self.workers == 1:
+            return func(arr, *args)
+        return image_tiles.run_tiled(func, arr, halo, args, self.workers,
+                                     self.tile_size)
+
+    def apply_array(self, func, *args, halo=None):
+        "Run an image_array filter on the whole of self.newimg"
+        arr = image_array.to_array(self.newimg)
+        image_array.from_array(self.newimg, self.run_array(func, arr, *args, halo=halo))
+
+    def apply_point(self, ops):
+        """Run a list of point operations from point_op() over self.newimg.
+        Consecutive lookup tables are composed into one and applied in a
+        single pass, consecutive pixel functions share a single loop. Tables
+        that change nothing (gamma 1.0, invert twice, ...) are skipped."""
+        runs = []
+        for op in ops:
+            if runs and runs[-1][0] == op[0] == "lut":
+                runs[-1] = ("lut", image_lut.compose(runs[-1][1], op[1]))
+            elif runs and runs[-1][0] == op[0] == "pixel":
+                runs[-1][1].append(op[1:])
+            elif op[0] == "lut":
+                runs.append(op)
+            else:
+                runs.append(("pixel", [op[1:]]))
+        runs = [(kind, run) for kind, run in runs
+                if kind != "lut" or not image_lut.is_identity(run)]
+        if not runs:
+            return
+        if self.engine == "array":
+            arr = image_array.to_array(self.newimg)
+            for kind, run in runs:
+                if kind == "lut":
+                    arr = image_array.apply_lut(arr, run)
+                    self.shared = None
+                    continue
+                for pixel_func, array_func in run:
+                    if array_func.func is image_array.greyscale:
+                        # Only needs the intensity plane, which may be shared.
+                        arr = image_array.greyscale(self.intensity(arr))
+                    else:
+                        arr = array_func(arr)
+                    # Shared intermediates belong to the input, not to arr.
+                    self.shared = None
+            image_array.from_array(self.newimg, arr)
+            return
+        for kind, run in runs:
+            if kind == "lut":
+                self.newimg.applyLookup(run)
+                continue
+            funcs = [pixel_func for pixel_func, array_func in run]
+            for x in range(self.width):
+                for y in range(self.height):
+                    p = self.newimg.getPixel(x,y)
+                    for func in funcs:
+                        p = func(p)
+                    # Write the modified pixel into our cloned window.
+                    self.newimg.setPixel(x,y,p)
+
+    def point_op(self, name, **params):
+        "See point_ops()"
+        return point_ops(name, **params)
+
+    def finish(self, func_name, draw=1):
+        "Write the processed image, unless autowrite is off (see image_pipeline)"
+        if self.autowrite:
+            self.write(func_name, draw)
+
+    @cached
     def invert(self):
         "Invert the colors of the image"
-        for x in range(self.width):
-            for y in range(self.height):
-                # For each pixel p, get the RGB values and invert them.
-                p = self.newimg.getPixel(x,y)
-                p.red = 255 - p.red
-                p.green = 255 - p.green
-                p.blue = 255 - p.blue
-                # Write the modified pixel into our cloned window.
-                self.newimg.setPixel(x,y,p)
-        # Call the method that draws, writes and decides the filename.
-        self.write("_inv")
+        self.apply_point(self.point_op("invert"))
 
+    @cached
     def greyscale(self):
-        "Convert image to greyscale"        
-        for x in range(self.width):
-            for y in range(self.height):
-                # For each pixel p get the RBG values and average them out.
-                p = self.newimg.getPixel(x,y)
-                avg = (p[0]+p[1]+p[2])/3
-                p.red = p.green = p.blue = avg
-                self.newimg.setPixel(x,y,p)
-        self.write("_grey")
+        "Convert image to greyscale"
+        self.apply_point(self.point_op("greyscale"))
 
+    @cached
     def blackwhite(self):
         "Convert image to black and white"
-        for x in range(self.width):
-            for y in range(self.height):
-                # Any pixel with an average r+g+b of >= 128 gets converted to
-                # white (255), all others to black (0).
-                p = self.newimg.getPixel(x,y)
-                avg = (p[0]+p[1]+p[2])/3
-                if avg >= 128:
-                    avg = 255
-                else:
-                    avg = 0
-                p.red = p.green = p.blue = avg
-                self.newimg.setPixel(x,y,p)
-        self.write("_bw")
+        self.apply_point(self.point_op("blackwhite"))
 
+    @cached
     def removecolor(self, color="R"):
         "Remove either (R)ed, (G)reen, (B)lue or a combination of those"
-        # TODO: Add options for different colors.
-        for x in range(self.width):
-            for y in range(self.height):
-                p = self.newimg.getPixel(x,y)
-                p.red = 0
-                self.newimg.setPixel(x,y,p)
-        self.write("_rc")
-        
+        self.apply_point(self.point_op("removecolor", color=color))
+
+    @cached
     def sepia(self):
         "Apply Sepia Toning to the image"
-        for x in range(self.width):
-            for y in range(self.height):
-                try:
-                    # Apply the Sepia filter to each value r, g, b of pixel p.
-                    p = self.newimg.getPixel(x,y)
-                    p.red = int(p.red * 0.393 + p.green * 0.769 + p.blue * 0.189)
-                    p.green = int(p.red * 0.349 + p.green * 0.686 + p.blue * 0.168)
-                    p.blue = int(p.red * 0.272 + p.green * 0.534 + p.blue * 0.131)
-                    self.newimg.setPixel(x,y,p)
-                except:
-                    continue
-        self.write("_sepia")
+        self.apply_point(self.point_op("sepia"))
+
+    @cached
+    def luminance(self):
+        """Convert image to greyscale, weighting the channels by how bright
+        they look instead of averaging them like greyscale()"""
+        self.apply_point(self.point_op("luminance"))
+
+    @cached
+    def mixer(self, rr=1.0, rg=0.0, rb=0.0, gr=0.0, gg=1.0, gb=0.0, br=0.0, bg=0.0,
+              bb=1.0, red_offset=0, green_offset=0, blue_offset=0):
+        """Channel mixer: every channel becomes a weighted sum of the original
+        channels plus an offset, e.g. rg is the weight of green in the new
+        red. mixer(rr=0, rb=1, br=1, bb=0) swaps red and blue."""
+        self.apply_point(self.point_op("mixer", rr=rr, rg=rg, rb=rb, gr=gr, gg=gg,
+                                       gb=gb, br=br, bg=bg, bb=bb,
+                                       red_offset=red_offset,
+                                       green_offset=green_offset,
+                                       blue_offset=blue_offset))
+
+    @cached
+    def threshold(self, level=128, channels="RGB"):
+        "Set channel values >= level to white (255), all others to black (0)"
+        self.apply_point(self.point_op("threshold", level=level, channels=channels))
+
+    @cached
+    def gamma(self, gamma=1.0, channels="RGB"):
+        "Gamma correct the image, values > 1 brighten the midtones"
+        self.apply_point(self.point_op("gamma", gamma=gamma, channels=channels))
+
+    @cached
+    def levels(self, black=0, white=255, channels="RGB"):
+        "Stretch the range black..white to the full 0..255"
+        self.apply_point(self.point_op("levels", black=black, white=white,
+                                       channels=channels))
+
+    @cached
+    def contrast(self, factor=1.0, channels="RGB"):
+        "Scale the distance of every value from the midpoint 128 by factor"
+        self.apply_point(self.point_op("contrast", factor=factor, channels=channels))
 
+    @cached
+    def saturation(self, factor=1.0):
+        "Scale the saturation (HLS) by factor, 0 gives grey, > 1 more colour"
+        self.apply_point(self.point_op("saturation", factor=factor))
+
+    @cached
+    def lightness(self, factor=1.0):
+        "Scale the lightness (HLS) by factor"
+        self.apply_point(self.point_op("lightness", factor=factor))
+
+    @cached
+    def hue(self, degrees=0.0):
+        "Rotate the hue (HSV) of every pixel by degrees"
+        self.apply_point(self.point_op("hue", degrees=degrees))
+
+    @cached
     def double(self, draw=0):
         "Double the size of the image"
         # The canvas size gets annoyingly big so by default we avoid drawing here.
         self.draw = draw
-        # We overwrite self.newimg because we need double the canvas size.
-        self.newimg = image.EmptyImage(self.width*2, self.height*2)
-        # In case we do decide to draw, self.win needs double canvas, too.
+        self.resample(self.width*2, self.height*2, "nearest")
+
+    @cached
+    def resize(self, width=None, height=None, scale=None, method="bilinear"):
+        """Resize
+
+        Scale the image to width x height or by the factor scale. If only
+        the width or the height is given, the other side keeps the aspect
+        ratio. method is one of image_resample.METHODS: "nearest",
+        "bilinear" or "area" (averages everything an output pixel covers,
+        best for shrinking)."""
+        width, height = image_resample.target_size(self.width, self.height,
+                                                   width, height, scale)
+        self.resample(width, height, method)
+
+    @cached
+    def thumbnail(self, size=256, method="area"):
+        """Thumbnail
+
+        Shrink the image to fit into size x size, keeping its aspect ratio.
+        Smaller images are left as they are. To skip decoding JPEGs at full
+        size, pass draft=(size, size) to ImageFilter (Pipeline and FanOut do
+        that if every recipe starts with the thumbnail)."""
+        width, height = image_resample.fit(self.width, self.height, size)
+        self.resample(width, height, method)
+
+    def resample(self, width, height, method="bilinear"):
+        """Replace self.newimg with a width x height version of it. The array
+        engine resamples blocks of rows at once (see image_array.resize), the
+        pixel engine row by row with getRow/setRow, see image_resample."""
+        image_resample.check_method(method)
+        src = self.newimg
+        self.newimg = self.new_image(width, height)
+        if self.engine == "array":
+            arr = image_array.resize(image_array.to_array(src), width, height, method)
+            image_array.from_array(self.newimg, arr)
+        else:
+            rows = image_resample.resize_rows(src.getRow, self.width, self.height,
+                                              width, height, method)
+            for y, row in enumerate(rows):
+                self.newimg.setRow(y, row)
+        # Later filters work on the resized image.
+        self.width, self.height = width, height
+        # In case we do decide to draw, self.win needs the new canvas size, too.
         if self.draw:
-            self.win = image.ImageWin(self.img_file, self.width*2, self.height*2)
-    
-        for y in range(self.height):
-            for x in range(self.width):
-                p = self.oldimg.getPixel(x,y)
-                self.newimg.setPixel(2*x,2*y, p)
-                self.newimg.setPixel(2*x+1, 2*y, p)
-                self.newimg.setPixel(2*x, 2*y+1, p)
-                self.newimg.setPixel(2*x+1, 2*y+1, p)
-        self.write("_double", 0)
-
-    def average(self):
+            self.win = image.ImageWin(self.img_file, width, height)
+
+    def neighbors(self, img, x, y, radius=1):
+        """Return the pixels of the (2*radius+1)**2 window around x, y.
+        The window is cut off at the image borders."""
+        return [img.getPixel(xx, yy)
+                for xx in range(max(x-radius, 0), min(x+radius+1, self.width))
+                for yy in range(max(y-radius, 0), min(y+radius+1, self.height))]
+
+    @cached
+    def average(self, radius=1, kernel="box", sigma=None, border="shrink"):
         """Average
 
-        Apply average of surrounding 8 pixels to the current pixel.
-        This should probably be updated to use Gaussian instead."""
-        
-        for y in range(self.height):
-            for x in range(self.width):
-                # Initialize both pixel p and the list to store neighbor pixels in.
-                p = self.newimg.getPixel(x, y)
-                neighbors = []
-                # Nested for loop to check 9 pixels total: p plus it's 8 neighbors.
-                # Use list comprehension here? Also get rid of try statements.
-                for xx in range(x-1, x+2):
-                    for yy in range(y-1, y+2):
-                        try:
-                            neighbor = self.newimg.getPixel(xx, yy)
-                            neighbors.append(neighbor)
-                        except:
-                            continue
-                nlen = len(neighbors)
-                # Average out the RBG values
-                if nlen:
-                # Uncommented, the following line would leave most of the white 
-                # untouched which works a little better for real photographs, imo.
-                #~ if nlen and p[0]+p[1]+p[2] < 690:
+        Apply the average of the surrounding (2*radius+1)**2 pixels to the
+        current pixel. kernel="gaussian" weights the neighbors with a Gaussian
+        of the given sigma (default radius/2), cut off at radius, instead.
+        The array engine computes box blurs from an integral image and
+        Gaussians as two 1d passes and supports all border modes of
+        image_array.BORDERS; the pixel engine only does box blurs with the
+        "shrink" border."""
+        check_kernel(kernel)
+        if self.engine == "array":
+            func, args, halo = average_window(radius, kernel, sigma, border)
+            self.apply_array(func, *args, halo=halo)
+        elif kernel != "box" or border != "shrink":
+            raise ValueError("%s kernels with %s borders need engine='array'"
+                             % (kernel, border))
+        else:
+            # Read from a snapshot so already averaged pixels don't leak into
+            # their neighbors.
+            src = self.newimg.copy()
+            for y in range(self.height):
+                for x in range(self.width):
+                    p = src.getPixel(x, y)
+                    neighbors = self.neighbors(src, x, y, radius)
+                    nlen = len(neighbors)
+                    # Uncommented, the following line would leave most of the white
+                    # untouched which works a little better for real photographs, imo.
+                    #~ if p[0]+p[1]+p[2] >= 690: continue
                     # Get the average of each r, g, b for all pixels in neighbors.
-                    p.red = sum([neighbors[i][0] for i in range(nlen)])/nlen
-                    p.green = sum([neighbors[i][1] for i in range(nlen)])/nlen
-                    p.blue = sum([neighbors[i][2] for i in range(nlen)])/nlen
+                    p.red = sum([n.red for n in neighbors])//nlen
+                    p.green = sum([n.green for n in neighbors])//nlen
+                    p.blue = sum([n.blue for n in neighbors])//nlen
                     self.newimg.setPixel(x,y,p)
-        self.write("_avg")
 
-    def median(self):
+    @cached
+    def median(self, radius=1, border="shrink"):
         """Median
 
-        Apply median of surrounding 8 pixels to current pixel
-        This usually gives better results than average()"""
-        
-        for y in range(self.height):
-            for x in range(self.width):
-                # Initialize both pixel p and the list to store neighbor pixels in.
-                p = self.newimg.getPixel(x, y)
-                neighbors = []
-                # Nested for loop to check 9 pixels total: p plus it's 8 neighbors.
-                # Use list comprehension here? Also get rid of try statements.
-                for xx in range(x-1, x+2):
-                    for yy in range(y-1, y+2):
-                        try:
-                            neighbor = self.newimg.getPixel(xx, yy)
-                            neighbors.append(neighbor)
-                        except:
-                            continue
-                nlen = len(neighbors)
-                # Making sure the list of pixels is not empty
-                if nlen:
-                    red = [neighbors[i][0] for i in range(nlen)]
-                    green = [neighbors[i][1] for i in range(nlen)]
-                    blue = [neighbors[i][2] for i in range(nlen)]
-                    # Sort the lists so we can later find the median.
-                    for i in [red, green, blue]:
-                        i.sort()
+        Apply the median of the surrounding (2*radius+1)**2 pixels to the
+        current pixel. This usually gives better results than average().
+        The array engine uses sliding histograms, so its cost per pixel stays
+        flat as the radius grows; the pixel engine sorts every window and
+        only supports the "shrink" border."""
+        if self.engine == "array":
+            func, args, halo = median_window(radius, border)
+            self.apply_array(func, *args, halo=halo)
+        elif border != "shrink":
+            raise ValueError("%s borders need engine='array'" % border)
+        else:
+            # Read from a snapshot so already filtered pixels don't leak into
+            # their neighbors.
+            src = self.newimg.copy()
+            for y in range(self.height):
+                for x in range(self.width):
+                    p = src.getPixel(x, y)
+                    neighbors = self.neighbors(src, x, y, radius)
+                    nlen = len(neighbors)
+                    red = sorted([n.red for n in neighbors])
+                    green = sorted([n.green for n in neighbors])
+                    blue = sorted([n.blue for n in neighbors])
                     # If the list has an odd number of items in it, the median is easy.
                     if nlen % 2:
-                        p.red = red[len(red)/2]
-                        p.green = green[len(green)/2]
-                        p.blue = blue[len(blue)/2]
+                        p.red = red[nlen//2]
+                        p.green = green[nlen//2]
+                        p.blue = blue[nlen//2]
                     # The median calculation if the list length is even:
                     else:
-                        p.red = (red[len(red)/2] + red[len(red)/2-1])/2
-                        p.green = (green[len(green)/2] + green[len(green)/2-1])/2
-                        p.blue = (blue[len(blue)/2] + blue[len(blue)/2-1])/2
+                        p.red = (red[nlen//2] + red[nlen//2-1])//2
+                        p.green = (green[nlen//2] + green[nlen//2-1])//2
+                        p.blue = (blue[nlen//2] + blue[nlen//2-1])//2
                     self.newimg.setPixel(x,y,p)
-        self.write("_median")
 
-    def sobel(self, draw=0):
-        "Using the Sobel Algorithm to apply Edge Detection to an image."
+    @cached
+    def sobel(self, draw=0, border=None, scale=4328.0, output="magnitude",
+              gradients=False):
+        """Using the Sobel Algorithm to apply Edge Detection to an image.
+
+        The array engine computes gx/gy as whole-array shifted differences of
+        the intensity plane and also supports border modes (the default None
+        leaves a black one pixel frame), scale="max", output="direction" and
+        gradients=True, which returns the gx, gy, magnitude and direction
+        planes as a dict."""
+        if self.engine != "array" and (border is not None or scale != 4328.0
+                                       or output != "magnitude" or gradients):
+            raise ValueError("Sobel options other than the defaults need engine='array'")
         self.draw = draw
         # Overwriting self.newimg because we need an empty canvas. Otherwise
         # the existing pixels would influence the newly written ones.
-        self.newimg = image.EmptyImage(self.width, self.height)
+        src = self.newimg
+        self.newimg = self.new_image(self.width, self.height)
         if self.draw:
             self.win = image.ImageWin(self.img_file, self.width*2, self.height*2)
-            
-        # Abandon all hope, ye who enter here. Terrible nested logic incoming.
-        for x in range(1, self.width-1):
-            for y in range(1, self.height-1):
-                # Apply the kx and ky gradient kernels to all pixels.
-                kx = ky = 0
-                # Nested for loop to check 9 pixels total: p plus it's 8 neighbors.
-                # Use list comprehension here? Also get rid of try statements.
-                for xx in range(x-1, x+2):
-                    for yy in range(y-1, y+2):
-                        # Extract RGB of the current neighbor pixel.
-                        p = self.oldimg.getPixel(xx, yy)
-                        r = p.getRed()
-                        g = p.getGreen()
-                        b = p.getBlue()
-
-                        ## The actual Sobel algorithm:
-                        # Left Row.
-                        if xx == x-1:
-                            if yy == y-1:
-                                kx -= (r+g+b)
-                                ky -= (r+g+b)
-                            elif yy == y:
-                                kx -= 2 * (r+g+b)
-                            elif yy == y+1:
-                                kx -= (r+g+b)
-                                ky += (r+g+b)
-                        # Middle Row.
-                        elif xx == x and yy == y-1:
-                            ky -= 2 * (r+g+b)
-                        elif xx == x and yy == y+1:
-                            ky += 2 * (r+g+b)
-                        # Right Row.
-                        elif xx == x+1:
-                            if yy == y-1:
-                                kx += (r+g+b)
-                                ky -= (r+g+b)
-                            elif yy == y:
-                                kx += 2 * (r+g+b)
-                            elif yy == y+1:
-                                kx += (r+g+b)
-                                ky += (r+g+b)
-                # Use Pythagoras' theorem to calc the relative length of kx & ky.
-                length = sqrt((kx**2) + (ky**2))
-                # Each pixels r+g+b can have 3*255=765 and for +/-4 the maximum is
-                # 4*765=3060. The final range is (sqrt(2*3060**2)=4328.
-                # Now we can normalize the length to the possible range:
-                length = int(length / 4328.0 * 255)
-
-                # Finally, apply the normalized length to each pixel.
-                p.red = p.green = p.blue = length
-                self.newimg.setPixel(x, y, p)
-        self.write("_sobel")
+
+        planes = None
+        if self.engine == "array":
+            arr = image_array.to_array(src)
+            if self.workers == 1:
+                # Sobel only needs the intensity plane, which may be shared.
+                arr = self.intensity(arr)
+            if gradients or scale == "max":
+                # Both need the planes of the whole image at once.
+                planes = image_array.sobel_planes(arr, border)
+                out = image_array.sobel_image(planes, scale, output)
+            else:
+                func, args, halo = sobel_window(border=border, scale=scale,
+                                                output=output)
+                out = self.run_array(func, arr, *args, halo=halo)
+            image_array.from_array(self.newimg, out)
+        else:
+            # Abandon all hope, ye who enter here. Terrible nested logic incoming.
+            for x in range(1, self.width-1):
+                for y in range(1, self.height-1):
+                    # Apply the kx and ky gradient kernels to all pixels.
+                    kx = ky = 0
+                    # Nested for loop to check 9 pixels total: p plus it's 8 neighbors.
+                    # Use list comprehension here? Also get rid of try statements.
+                    for xx in range(x-1, x+2):
+                        for yy in range(y-1, y+2):
+                            # Extract RGB of the current neighbor pixel.
+                            p = src.getPixel(xx, yy)
+                            r = p.getRed()
+                            g = p.getGreen()
+                            b = p.getBlue()
+
+                            ## The actual Sobel algorithm:
+                            # Left Row.
+                            if xx == x-1:
+                                if yy == y-1:
+                                    kx -= (r+g+b)
+                                    ky -= (r+g+b)
+                                elif yy == y:
+                                    kx -= 2 * (r+g+b)
+                                elif yy == y+1:
+                                    kx -= (r+g+b)
+                                    ky += (r+g+b)
+                            # Middle Row.
+                            elif xx == x and yy == y-1:
+                                ky -= 2 * (r+g+b)
+                            elif xx == x and yy == y+1:
+                                ky += 2 * (r+g+b)
+                            # Right Row.
+                            elif xx == x+1:
+                                if yy == y-1:
+                                    kx += (r+g+b)
+                                    ky -= (r+g+b)
+                                elif yy == y:
+                                    kx += 2 * (r+g+b)
+                                elif yy == y+1:
+                                    kx += (r+g+b)
+                                    ky += (r+g+b)
+                    # Use Pythagoras' theorem to calc the relative length of kx & ky.
+                    length = sqrt((kx**2) + (ky**2))
+                    # Each pixels r+g+b can have 3*255=765 and for +/-4 the maximum is
+                    # 4*765=3060. The final range is (sqrt(2*3060**2)=4328.
+                    # Now we can normalize the length to the possible range:
+                    length = int(length / 4328.0 * 255)
+
+                    # Finally, apply the normalized length to each pixel.
+                    p.red = p.green = p.blue = length
+                    self.newimg.setPixel(x, y, p)
+        if gradients:
+            return planes
 
 
 if __name__ == "__main__":
-    # Leave out the "draw=0" to produce a popup of the image once it's complete.
-    img = ImageFilter("example.png", draw=0)
-    img.sobel()
+    # Batch mode, see image_batch.py or run with -h. Without arguments this
+    # applies sobel to example.png. For a popup of the result use
+    # ImageFilter("example.png").sobel(draw=1) instead.
+    import sys
+    from image_batch import main
+    sys.exit(main())
@@ -0,0 +1,88 @@
+""" Image LUT: per-channel lookup tables for tone operations
+
+    A tone operation that maps every channel value 0..255 to a new value on
+    its own (invert, threshold, gamma, ...) compiles into a lookup table. A
+    table is a flat list of 768 ints: 256 entries for red, then green, then
+    blue, the same layout PIL's Image.point() takes. Consecutive tables
+    compose into one, so a chain of tone operations costs a single pass over
+    the image, see AbstractImage.applyLookup and image_array.apply_lut.
+"""
+
+
+CHANNELS = "RGB"
+
+
+def clamp(value):
+    "Round value to the nearest int in 0..255"
+    return min(max(int(value + 0.5), 0), 255)
+
+
+def table(func, channels=CHANNELS):
+    """Return the table that maps each value v of the given channels to
+    func(v), clamped to 0..255. The other channels are left alone."""
+    channels = check_channels(channels)
+    lut = []
+    for channel in CHANNELS:
+        if channel in channels:
+            lut.extend(clamp(func(v)) for v in range(256))
+        else:
+            lut.extend(range(256))
+    return lut
+
+
+def check_channels(channels):
+    "Return channels upper-cased, raise a ValueError for anything but R, G, B"
+    channels = channels.upper()
+    if not channels or set(channels) - set(CHANNELS):
+        raise ValueError("Channels must be a combination of R, G and B, not %r"
+                         % channels)
+    return channels
+
+
+def identity():
+    "The table that changes nothing"
+    return table(lambda v: v)
+
+
+def compose(first, second):
+    "Return the table that applies first and then second"
+    return [second[i - i % 256 + first[i]] for i in range(768)]
+
+
+def is_identity(lut):
+    "Whether applying lut would change nothing"
+    return lut == identity()
+
+
+def invert():
+    "Invert every channel"
+    return table(lambda v: 255 - v)
+
+
+def removecolor(color="R"):
+    "Set (R)ed, (G)reen, (B)lue or a combination of those (e.g. RG) to 0"
+    return table(lambda v: 0, color)
+
+
+def threshold(level=128, channels=CHANNELS):
+    "Values >= level become white (255), all others black (0)"
+    return table(lambda v: 255 if v >= level else 0, channels)
+
+
+def gamma(gamma=1.0, channels=CHANNELS):
+    "Gamma correction, values > 1 brighten the midtones"
+    if gamma <= 0:
+        raise ValueError("gamma must be positive, not %r" % gamma)
+    return table(lambda v: 255 * (v / 255.0) ** (1.0 / gamma), channels)
+
+
+def levels(black=0, white=255, channels=CHANNELS):
+    "Stretch black..white to the full 0..255 range"
+    if not 0 <= black < white <= 255:
+        raise ValueError("Levels need 0 <= black < white <= 255")
+    return table(lambda v: (v - black) * 255.0 / (white - black), channels)
+
+
+def contrast(factor=1.0, channels=CHANNELS):
+    "Scale the distance of every value from the midpoint 128 by factor"
+    return table(lambda v: 128 + (v - 128) * factor, channels)
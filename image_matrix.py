@@ -0,0 +1,67 @@
+""" Image Matrix: colour matrices in integer fixed point
+
+    A colour matrix maps every pixel to new channel values that are each a
+    weighted sum of its original red, green and blue plus an offset:
+
+        red' = rr*red + rg*green + rb*blue + red_offset    (same for green, blue)
+
+    Sepia, channel mixers and luminance weighted greyscale are all colour
+    matrices. The weights are stored as integers scaled by 2**SHIFT, so
+    applying a matrix takes nothing but integer multiplications and a shift,
+    and every result is rounded and clamped to 0..255 instead of overflowing.
+    A matrix is a tuple of 12 ints: the 9 weights row by row, then the 3
+    offsets. apply_pixel() applies one to a Pixel, image_array.apply_matrix()
+    to a whole array with the exact same integer math.
+"""
+
+
+SHIFT = 16
+ONE = 1 << SHIFT
+HALF = ONE >> 1
+
+# The classic sepia tone.
+SEPIA = ((0.393, 0.769, 0.189),
+         (0.349, 0.686, 0.168),
+         (0.272, 0.534, 0.131))
+# How bright red, green and blue look (ITU-R BT.601), they add up to 1.
+LUMA = (0.299, 0.587, 0.114)
+
+
+def matrix(rows, offsets=(0, 0, 0)):
+    "Compile 3 rows of 3 weights and 3 offsets (in levels) into a matrix"
+    if len(rows) != 3 or any(len(row) != 3 for row in rows) or len(offsets) != 3:
+        raise ValueError("A colour matrix needs 3 rows of 3 weights and 3 offsets")
+    return (tuple(int(round(weight * ONE)) for row in rows for weight in row)
+            + tuple(int(round(offset * ONE)) for offset in offsets))
+
+
+def sepia():
+    "Tone the image sepia"
+    return matrix(SEPIA)
+
+
+def luminance():
+    "Greyscale with every channel weighted by how bright it looks"
+    return matrix((LUMA, LUMA, LUMA))
+
+
+def mixer(rr=1.0, rg=0.0, rb=0.0, gr=0.0, gg=1.0, gb=0.0, br=0.0, bg=0.0, bb=1.0,
+          red_offset=0, green_offset=0, blue_offset=0):
+    """Mix every output channel from the original channels: rg is the weight
+    of green in the new red and so on. The defaults leave the image alone."""
+    return matrix(((rr, rg, rb), (gr, gg, gb), (br, bg, bb)),
+                  (red_offset, green_offset, blue_offset))
+
+
+def clamp(value):
+    "Turn a fixed point value into a level, rounded and clamped to 0..255"
+    return min(max((value + HALF) >> SHIFT, 0), 255)
+
+
+def apply_pixel(p, matrix):
+    "Apply matrix to pixel p, reading only its original channels"
+    r, g, b = p.red, p.green, p.blue
+    p.red = clamp(matrix[0]*r + matrix[1]*g + matrix[2]*b + matrix[9])
+    p.green = clamp(matrix[3]*r + matrix[4]*g + matrix[5]*b + matrix[10])
+    p.blue = clamp(matrix[6]*r + matrix[7]*g + matrix[8]*b + matrix[11])
+    return p
@@ -0,0 +1,250 @@
+""" Image Pipeline: chain several ImageFilter filters on one image
+
+    Every ImageFilter method writes (encodes and saves) its result right away,
+    so chaining greyscale, blackwhite and invert costs three full passes, three
+    encodes and two intermediate files. A Pipeline takes the whole recipe up
+    front and only materialises the final image:
+
+        Pipeline(["greyscale", ("average", {"radius": 2}), "invert"]).run("in.png")
+
+    Adjacent point filters (invert, greyscale, blackwhite, removecolor, sepia
+    and the tone operations) are fused into a single stage, in which
+    consecutive lookup tables compose into one. Neighborhood filters
+    (average, median, sobel) and the resizing filters need the finished
+    output of the previous stage and run as stages of their own. A recipe
+    that starts with a thumbnail decodes JPEGs at a reduced size.
+
+    Pipeline.stream() runs the same recipe strip by strip for images that
+    don't fit in memory, see image_stream.py.
+
+    A FanOut produces several outputs from one source, decoding it only once:
+
+        FanOut(["greyscale", "blackwhite", "sobel"]).run("in.png")
+
+    Work that several recipes have in common is done once and shared: the
+    greyscale step of greyscale and blackwhite, and on the array engine the
+    intensity plane greyscale and sobel both start from. The outputs are
+    encoded on a thread pool while the next ones are computed.
+"""
+
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os.path import splitext
+
+from image_filter import ImageFilter, POINT_OPS, SUFFIXES, load_array_engine
+
+
+class Pipeline(object):
+
+    def __init__(self, steps, engine="pixel", workers=1, tile_size=512, cache=None,
+                 stats=None):
+        """Steps are filter names or (name, params) tuples, the remaining
+        arguments are passed on to ImageFilter. With an image_cache.ResultCache
+        the result of the whole recipe is cached. A cImage.Stats records the
+        time of every stage."""
+        self.steps = []
+        for step in steps:
+            if isinstance(step, str):
+                step = (step, {})
+            name, params = step
+            if name not in SUFFIXES:
+                raise ValueError("Unknown filter %r, use one of %s"
+                                 % (name, sorted(SUFFIXES)))
+            self.steps.append((name, dict(params)))
+        self.engine = engine
+        self.workers = workers
+        self.tile_size = tile_size
+        self.cache = cache
+        self.stats = stats
+
+    def stages(self):
+        """Group the steps into stages: a list of point filter steps that run
+        fused, or a single step of any other filter"""
+        stages = []
+        for name, params in self.steps:
+            if name in POINT_OPS and stages and stages[-1][0][0] in POINT_OPS:
+                stages[-1].append((name, params))
+            else:
+                stages.append([(name, params)])
+        return stages
+
+    def draft(self):
+        """The reduced size JPEG sources may be decoded at: if the recipe
+        starts with a thumbnail nothing larger is needed"""
+        if self.steps and self.steps[0][0] == "thumbnail":
+            size = self.steps[0][1].get("size", 256)
+            return (size, size)
+        return None
+
+    def suffix(self):
+        "The filename suffix of the result, e.g. _grey_bw_inv"
+        return "".join(SUFFIXES[name] for name, params in self.steps)
+
+    def run(self, img_file, out_file=None):
+        """Run all stages on img_file and write the final image to out_file
+        (default: img_file with the suffix of every step). Returns the
+        ImageFilter so the result can be inspected or drawn."""
+        img = ImageFilter(img_file, draw=0, engine=self.engine,
+                          workers=self.workers, tile_size=self.tile_size,
+                          autowrite=0, stats=self.stats, draft=self.draft())
+        if out_file is None:
+            img_name, img_ext = img.strip_name()
+            out_file = img_name + self.suffix() + img_ext
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(img.newimg, "pipeline", {"steps": self.steps},
+                                 self.engine, splitext(out_file)[1])
+        img.cached_result(key, partial(self.run_stages, img), self.cache)
+        img.save(out_file)
+        return img
+
+    def run_stages(self, img):
+        "Run all stages on the ImageFilter img"
+        for stage in self.stages():
+            name, params = stage[0]
+            if name in POINT_OPS:
+                ops = []
+                for name, params in stage:
+                    ops.extend(img.point_op(name, **params))
+                # The fused stage is timed as e.g. "greyscale+invert".
+                with img.phase("+".join(name for name, params in stage)):
+                    img.apply_point(ops)
+            else:
+                getattr(img, name)(**params)
+
+    def check_stream(self):
+        "Raise a ValueError if any of the steps can't be streamed, see stream()"
+        load_array_engine()
+        import image_stream
+        image_stream.compile_steps(self.steps)
+
+    def stream(self, img_file, out_file=None, strip_rows=64):
+        """Run the steps over img_file strip by strip and write the result to
+        out_file (.png or .ppm, default: img_file with the suffix of every
+        step, as PNG unless it is a PPM). Always uses the array functions,
+        see image_stream."""
+        load_array_engine()
+        import image_stream
+        if out_file is None:
+            img_name, img_ext = splitext(img_file)
+            if img_ext.lower() != ".ppm":
+                img_ext = ".png"
+            out_file = img_name + self.suffix() + img_ext
+        image_stream.stream(img_file, out_file, self.steps, strip_rows)
+        return out_file
+
+
+class FanOut(object):
+
+    def __init__(self, recipes, engine="pixel", workers=1, tile_size=512, threads=None,
+                 stats=None):
+        """Recipes is a list of outputs, each a filter name, a (name, params)
+        tuple or a list of those (the steps of a Pipeline). The remaining
+        arguments are passed on to ImageFilter, the results are encoded on
+        threads threads (default: one per output)."""
+        self.pipelines = []
+        for recipe in recipes:
+            if not isinstance(recipe, list):
+                recipe = [recipe]
+            self.pipelines.append(Pipeline(recipe, engine))
+        self.engine = engine
+        self.workers = workers
+        self.tile_size = tile_size
+        self.threads = threads
+        self.stats = stats
+
+    def suffixes(self):
+        """The filename suffix of every recipe. Recipes that would share one
+        (e.g. the same filter with different parameters) are numbered, so no
+        result overwrites another."""
+        suffixes = [pipeline.suffix() for pipeline in self.pipelines]
+        shared = set(suffix for suffix in suffixes if suffixes.count(suffix) > 1)
+        seen = {}
+        for i, suffix in enumerate(suffixes):
+            if suffix in shared:
+                seen[suffix] = seen.get(suffix, 0) + 1
+                suffixes[i] = "%s_%d" % (suffix, seen[suffix])
+        return suffixes
+
+    def units(self, img, pipeline):
+        """Split the steps of pipeline into the units work is shared in: the
+        single steps of point filters (see POINT_OPS), which are compiled
+        into point operations, and all other filters. Returns a list of
+        (key, point operation or None, filter name, params)."""
+        units = []
+        for name, params in pipeline.steps:
+            params_key = repr(sorted(params.items()))
+            if name in POINT_OPS:
+                # blackwhite's greyscale step has the same key as greyscale.
+                for step, op in zip(POINT_OPS[name], img.point_op(name, **params)):
+                    units.append(((step[0], step[-1], params_key), op, name, params))
+            else:
+                units.append(((name, params_key), None, name, params))
+        return units
+
+    def run_units(self, img, source, shared, units):
+        "Run units on a copy of source, leaving the result in img.newimg"
+        img.reset(source)
+        img.shared = shared
+        ops, names = [], []
+        for key, op, name, params in units:
+            if op is not None:
+                ops.append(op)
+                if name not in names:
+                    names.append(name)
+                continue
+            if ops:
+                with img.phase("+".join(names)):
+                    img.apply_point(ops)
+                ops, names = [], []
+            getattr(img, name)(**params)
+        if ops:
+            with img.phase("+".join(names)):
+                img.apply_point(ops)
+
+    def run(self, img_file, outdir=None):
+        """Decode img_file once, compute every recipe and write each result
+        to img_file with the suffix of its steps (see suffixes(), in outdir if
+        given). Returns the list of output files."""
+        drafts = [pipeline.draft() for pipeline in self.pipelines]
+        img = ImageFilter(img_file, draw=0, engine=self.engine, workers=self.workers,
+                          tile_size=self.tile_size, autowrite=0, stats=self.stats,
+                          draft=max(drafts) if None not in drafts else None)
+        plans = [self.units(img, pipeline) for pipeline in self.pipelines]
+        # How many recipes go through every prefix of units.
+        uses = {}
+        for units in plans:
+            for i in range(1, len(units) + 1):
+                key = tuple(unit[0] for unit in units[:i])
+                uses[key] = uses.get(key, 0) + 1
+        # The result of every prefix computed so far, and the intermediates
+        # shared by everything that starts from it. The source is never changed.
+        results = {(): img.newimg}
+        shared = {}
+        img_name, img_ext = img.strip_name()
+        if outdir is not None:
+            img_name = os.path.join(outdir, os.path.basename(img_name))
+        out_files = []
+        with ThreadPoolExecutor(self.threads or len(plans) or 1) as pool:
+            jobs = []
+            for suffix, units in zip(self.suffixes(), plans):
+                keys = [tuple(unit[0] for unit in units[:i]) for i in range(len(units) + 1)]
+                # Continue from the longest prefix that is already computed and
+                # stop at every prefix another recipe needs, too.
+                start = max(i for i, key in enumerate(keys) if key in results)
+                while start < len(units):
+                    end = start + 1
+                    while end < len(units) and uses[keys[end]] == 1:
+                        end += 1
+                    self.run_units(img, results[keys[start]],
+                                   shared.setdefault(keys[start], {}), units[start:end])
+                    results[keys[end]] = img.newimg
+                    start = end
+                out_file = img_name + suffix + img_ext
+                jobs.append(pool.submit(results[keys[-1]].save, out_file, strict=True))
+                out_files.append(out_file)
+            for job in jobs:
+                job.result()
+        return out_files
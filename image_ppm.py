@@ -0,0 +1,137 @@
+""" Image PPM: memory-mapped binary PPM and PGM files
+
+    Binary PPM (P6, rgb) and PGM (P5, grey) files are a short text header
+    followed by the raw 8 bit pixels, row by row. There is nothing to decode,
+    so instead of reading them into memory we map the file and hand out the
+    pixel data as a memoryview: loading is free, pages are only read when a
+    filter touches them, and NumPy arrays (see image_array.load_ppm and
+    image_stream) sit directly on top of the mapping.
+
+        with PPMFile("scan.ppm") as src, create("out.ppm", src.width, src.height) as dst:
+            dst.data[:] = src.data
+
+    That makes PPM the fast interchange format between runs: writing and
+    reading it back costs a copy of the pixels, where PNG costs an encode
+    and a decode that can be slower than the filters themselves.
+"""
+
+
+import mmap
+
+
+EXTENSIONS = (".ppm", ".pgm", ".pnm")
+
+
+def read_token(f):
+    "Read the next whitespace separated token of a header"
+    token = b""
+    while True:
+        char = f.read(1)
+        if char == b"#" and not token:
+            # Comments run to the end of the line.
+            f.readline()
+        elif not char or char.isspace():
+            if token or not char:
+                return token
+        else:
+            token += char
+
+
+def read_header(f):
+    """Return (channels, width, height) of a binary PPM (P6) or PGM (P5)
+    file. Afterwards f is positioned at the first pixel."""
+    magic = read_token(f)
+    if magic not in (b"P5", b"P6"):
+        raise ValueError("Only binary PPM and PGM files (P6, P5) are supported")
+    try:
+        width, height, maxval = [int(read_token(f)) for i in range(3)]
+    except ValueError:
+        raise ValueError("Bad PPM header in %r" % f.name)
+    if maxval != 255:
+        raise ValueError("Only 8 bit PPM files are supported, maxval is %d" % maxval)
+    return (3 if magic == b"P6" else 1), width, height
+
+
+def header(width, height, channels=3):
+    "Return the header of a binary PPM (channels=3) or PGM (channels=1) file"
+    if channels not in (1, 3):
+        raise ValueError("PPM files have 1 or 3 channels, not %r" % channels)
+    return b"%s\n%d %d\n255\n" % (b"P6" if channels == 3 else b"P5", width, height)
+
+
+class PPMFile(object):
+
+    def __init__(self, filename, mode="r", width=None, height=None, channels=3):
+        """Map filename. mode="r" maps an existing file read-only, mode="w"
+        creates (or truncates) it with the given size and maps it writable.
+        The pixels are available as the memoryview self.data."""
+        if mode not in ("r", "w"):
+            raise ValueError("Unknown mode %r, use 'r' or 'w'" % mode)
+        self.filename = filename
+        if mode == "r":
+            self.file = open(filename, "rb")
+            self.channels, self.width, self.height = read_header(self.file)
+            offset = self.file.tell()
+            access = mmap.ACCESS_READ
+        else:
+            head = header(width, height, channels)
+            self.channels, self.width, self.height = channels, width, height
+            offset = len(head)
+            self.file = open(filename, "w+b")
+            self.file.write(head)
+            self.file.truncate(offset + self.size())
+            access = mmap.ACCESS_WRITE
+        if self.size() == 0:
+            self.file.close()
+            raise ValueError("%r has no pixels" % filename)
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=access)
+        except ValueError:
+            self.file.close()
+            raise ValueError("%r is truncated" % filename)
+        if len(self.map) < offset + self.size():
+            self.map.close()
+            self.file.close()
+            raise ValueError("%r is truncated" % filename)
+        self.data = memoryview(self.map)[offset:offset + self.size()]
+
+    def size(self):
+        "The number of bytes of pixel data"
+        return self.width * self.height * self.channels
+
+    def rows(self, top, bottom):
+        "Return the pixel data of rows top..bottom-1 (without copying)"
+        stride = self.width * self.channels
+        return self.data[top * stride:bottom * stride]
+
+    def flush(self):
+        "Write changes to self.data back to the file"
+        self.map.flush()
+
+    def close(self):
+        """Unmap and close the file. Arrays and images still using self.data
+        keep the mapping alive until they are gone."""
+        try:
+            self.data.release()
+            self.map.close()
+        except BufferError:
+            # Still in use, the mapping goes away with its last user.
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def create(filename, width, height, channels=3):
+    "Create a mapped, writable PPM (channels=3) or PGM (channels=1) file"
+    return PPMFile(filename, "w", width, height, channels)
+
+
+def save(filename, width, height, data, channels=3):
+    "Write packed pixel data (any buffer) to a PPM or PGM file"
+    with create(filename, width, height, channels) as ppm:
+        ppm.data[:] = memoryview(data).cast("B")
@@ -0,0 +1,123 @@
+""" Image Pyramid: fast previews on reduced sizes, refined in the background
+
+    Tuning a filter's parameters means running it again and again, but only
+    the last run needs the full resolution. A Pyramid decodes its source
+    once and keeps a stack of levels, each half the size of the one before,
+    made by area averaging (see image_resample). Filters run on any level:
+
+        pyramid = Pyramid("photo.jpg", engine="array")
+        img, full = pyramid.preview("median", level=2, radius=8)
+        img.newimg.draw(win)            # 1/16 of the pixels, ready right away
+        full.result().save("photo_median.jpg")
+
+    Radii, sigmas and sizes are scaled to the level (radius 8 becomes 2 on
+    level 2), so a preview looks like a shrunken version of the full result.
+    preview() also starts the same filter at full resolution on a background
+    thread; starting a new preview drops a refinement that hasn't begun yet.
+    Levels are built on first use and kept for the life of the Pyramid.
+"""
+
+
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
+from image_filter import ImageFilter, SUFFIXES
+
+
+# Levels stop before their shorter side would drop below this.
+MIN_SIZE = 16
+# Parameters measured in pixels, scaled down with the level.
+LENGTHS = ("radius", "sigma", "width", "height", "size")
+
+
+def scale_params(params, level):
+    """Return params for running a filter on pyramid level (halved level
+    times): lengths in pixels are divided by 2**level, radii and sizes
+    stay at least 1"""
+    scaled = dict(params)
+    for key in LENGTHS:
+        value = scaled.get(key)
+        if value is None or isinstance(value, str):
+            continue
+        if key == "sigma":
+            scaled[key] = value / 2.0 ** level
+        else:
+            scaled[key] = max(int(round(value / 2.0 ** level)), min(value, 1))
+    return scaled
+
+
+class Pyramid(object):
+
+    def __init__(self, img_file, engine="pixel", workers=1, tile_size=512,
+                 min_size=MIN_SIZE, stats=None):
+        """Decode img_file for a pyramid down to levels of min_size pixels,
+        the remaining arguments are passed on to ImageFilter"""
+        self.img = ImageFilter(img_file, draw=0, engine=engine, workers=workers,
+                               tile_size=tile_size, autowrite=0, stats=stats)
+        self.min_size = min_size
+        # Level 0 is the source itself.
+        self.images = [self.img.oldimg]
+        self.executor = None
+        self.refining = None
+
+    def depth(self):
+        "The number of levels, including the full resolution one"
+        width, height = self.img.oldimg.getWidth(), self.img.oldimg.getHeight()
+        levels = 1
+        while min(width, height) // 2 >= self.min_size:
+            width, height = width // 2, height // 2
+            levels += 1
+        return levels
+
+    def level(self, n):
+        "Return the image of level n, building the levels up to it once"
+        if not 0 <= n < self.depth():
+            raise ValueError("The pyramid has levels 0..%d, not %r" % (self.depth() - 1, n))
+        while len(self.images) <= n:
+            img = self.filter(self.images[-1])
+            with img.phase("pyramid"):
+                img.resample(img.width // 2, img.height // 2, "area")
+            self.images.append(img.newimg)
+        return self.images[n]
+
+    def filter(self, source):
+        """Return an ImageFilter working on a copy of source. It shares the
+        decoded image with all others but not its result, so several can run
+        at once."""
+        img = copy.copy(self.img)
+        img.reset(source)
+        return img
+
+    def run(self, name, level=0, **params):
+        """Run the filter name on level with params scaled to it. Returns the
+        ImageFilter, its newimg holds the result."""
+        if name not in SUFFIXES:
+            raise ValueError("Unknown filter %r, use one of %s" % (name, sorted(SUFFIXES)))
+        img = self.filter(self.level(level))
+        getattr(img, name)(**scale_params(params, level))
+        return img
+
+    def preview(self, name, level=1, **params):
+        """Run the filter name on level right away and at full resolution in
+        the background. Returns the ImageFilter of the preview and a Future
+        of the full resolution one. A refinement that hasn't started yet is
+        dropped, only the latest parameters are worth refining."""
+        img = self.run(name, level, **params)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(1)
+        if self.refining is not None:
+            self.refining.cancel()
+        self.refining = self.executor.submit(self.run, name, 0, **params)
+        return img, self.refining
+
+    def close(self):
+        "Wait for the background refinement and stop its thread"
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,124 @@
+""" Image Resample: resizing with nearest, bilinear and area filters
+
+    Resampling is separable: every output column is a weighted sum of a few
+    source columns and every output row a weighted sum of a few source rows.
+    weights() computes those (index, weight) lists once per axis, so the
+    actual work is done a row at a time: resize_rows() here for the pixel
+    engine and image_array.resize(), which gathers and weighs whole blocks of
+    rows and columns, for the array engine.
+
+    nearest - Picks the source pixel under the center of the output pixel.
+        Scaling by 2 repeats every pixel in a 2x2 block, like double().
+    bilinear - Interpolates between the two nearest source pixels on each
+        axis. Smooth for enlarging, but aliases when shrinking a lot.
+    area - Averages all source pixels covered by the output pixel, weighted
+        by how much of them is covered. The right choice for thumbnails.
+"""
+
+
+from operator import itemgetter
+
+
+METHODS = ("nearest", "bilinear", "area")
+
+
+def check_method(method):
+    "Raise a ValueError for unknown resampling methods"
+    if method not in METHODS:
+        raise ValueError("Unknown resampling method %r, use one of %s"
+                         % (method, METHODS))
+
+
+def target_size(width, height, new_width=None, new_height=None, scale=None):
+    """Return the size of an image of width x height resized to new_width x
+    new_height or by scale. If only one side is given the other one keeps
+    the aspect ratio."""
+    if scale is not None:
+        if new_width is not None or new_height is not None:
+            raise ValueError("Give either a scale or a size, not both")
+        if scale <= 0:
+            raise ValueError("The scale must be positive, not %r" % scale)
+        return max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
+    if new_width is None and new_height is None:
+        raise ValueError("Give a width, a height or a scale")
+    if new_width is None:
+        new_width = max(int(round(width * new_height / float(height))), 1)
+    elif new_height is None:
+        new_height = max(int(round(height * new_width / float(width))), 1)
+    if new_width < 1 or new_height < 1:
+        raise ValueError("The size must be positive, not %dx%d" % (new_width, new_height))
+    return new_width, new_height
+
+
+def fit(width, height, size):
+    """Return the largest size with the aspect ratio of width x height that
+    fits into size x size. Images that already fit are never enlarged."""
+    if size < 1:
+        raise ValueError("The size must be positive, not %r" % size)
+    scale = min(size / float(width), size / float(height), 1.0)
+    return max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
+
+
+def weights(src, dst, method="bilinear"):
+    """For resampling an axis of length src to length dst, return a list
+    with the (source index, weight) pairs of every output index"""
+    check_method(method)
+    scale = src / float(dst)
+    result = []
+    for i in range(dst):
+        if method == "nearest":
+            result.append([(min(int((i + 0.5) * scale), src - 1), 1.0)])
+        elif method == "bilinear":
+            # The source position of the output pixel's center.
+            x = min(max((i + 0.5) * scale - 0.5, 0.0), src - 1.0)
+            j = int(x)
+            frac = x - j
+            if frac:
+                result.append([(j, 1.0 - frac), (j + 1, frac)])
+            else:
+                result.append([(j, 1.0)])
+        else:
+            # The output pixel covers start..end in source pixels.
+            start, end = i * scale, (i + 1) * scale
+            pairs = []
+            for j in range(int(start), min(int(end) + 1, src)):
+                covered = min(end, j + 1) - max(start, j)
+                if covered > 0:
+                    pairs.append((j, covered / scale))
+            result.append(pairs)
+    return result
+
+
+def resize_rows(get_row, width, height, new_width, new_height, method="bilinear"):
+    """Resize an image row by row. get_row(y) returns source row y as packed
+    rgb bytes, the resized rows are yielded the same way. Every source row
+    is fetched and resampled horizontally only once."""
+    xweights = weights(width, new_width, method)
+    yweights = weights(height, new_height, method)
+    if method == "nearest":
+        # Just a byte shuffle, done by a single itemgetter call per row.
+        pick = itemgetter(*[3*j + c for pairs in xweights
+                            for j, w in pairs for c in range(3)])
+        last = row = None
+        for pairs in yweights:
+            y = pairs[0][0]
+            if y != last:
+                row, last = bytes(pick(get_row(y))), y
+            yield row
+        return
+    rows = {}
+    for pairs in yweights:
+        for y, w in pairs:
+            if y not in rows:
+                src = get_row(y)
+                rows[y] = [sum(src[3*j + c] * w for j, w in xpairs)
+                           for xpairs in xweights for c in range(3)]
+        # Rows above the current one are never needed again.
+        for y in [y for y in rows if y < pairs[0][0]]:
+            del rows[y]
+        out = [0.0] * (new_width * 3)
+        for y, w in pairs:
+            row = rows[y]
+            for k in range(len(out)):
+                out[k] += row[k] * w
+        yield bytes(min(int(v + 0.5), 255) for v in out)
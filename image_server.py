@@ -0,0 +1,261 @@
+""" Image Server: a local asyncio job server for filter requests
+
+    Usage: python image_server.py [--unix PATH | --host HOST --port PORT]
+                                  [-e ENGINE] [-j WORKERS] [--max-queue N]
+
+    Other processes on the same machine send jobs as JSON, one object per
+    line, over a Unix socket or a localhost TCP port, and get one JSON line
+    back per job (jobs on one connection may finish out of order, match them
+    by their "id"):
+
+        {"id": 1, "input": "in.png", "filters": ["greyscale", "average:radius=2"],
+         "output": "out.png"}
+        {"id": 2, "data": "<base64 png>", "format": ".png", "filters": [["sobel", {}]]}
+        {"id": 3, "op": "stats"}
+
+    A job reads either the file "input" or the base64 encoded image "data"
+    (with the extension "format"), runs its filters (names, "name:key=value"
+    strings as for image_batch, or [name, params] pairs) as a Pipeline and
+    writes the result to "output" or, without one, returns it base64 encoded
+    in "data" ("output_format" picks the format). The answer carries "ok" and
+    either the result or an "error".
+
+    The filters run on a process pool. At most --max-queue jobs are queued or
+    running at once, any further job is rejected right away with the error
+    "overloaded" instead of piling up. {"op": "stats"} reports the queue
+    depth, counters and latency percentiles of the recent jobs.
+"""
+
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from image_batch import parse_filter
+from image_filter import ENGINES
+from image_pipeline import Pipeline
+
+
+# How many of the most recent jobs the latency percentiles are taken over.
+HISTORY = 1000
+
+
+def parse_steps(filters):
+    "Turn the filters of a job into the steps of a Pipeline"
+    if not isinstance(filters, list):
+        raise ValueError("filters must be a list")
+    steps = []
+    for spec in filters:
+        if isinstance(spec, str):
+            try:
+                steps.append(parse_filter(spec))
+            except argparse.ArgumentTypeError as error:
+                raise ValueError(str(error))
+        else:
+            name, params = spec
+            steps.append((name, dict(params)))
+    return steps
+
+
+def check_ext(ext):
+    "Raise a ValueError unless ext is a bare file extension like .png"
+    if not isinstance(ext, str) or not ext.startswith(".") or len(ext) < 2 \
+            or os.sep in ext or (os.altsep and os.altsep in ext):
+        raise ValueError("bad extension %r, use e.g. '.png'" % (ext,))
+    return ext
+
+
+def run_job(steps, engine, source=None, data=None, ext=".png", output=None,
+            output_ext=None):
+    """Worker: run steps on the image file source or the base64 encoded image
+    data. Returns the output path, or the encoded result without one."""
+    check_ext(ext)
+    if output_ext is not None:
+        check_ext(output_ext)
+    with tempfile.TemporaryDirectory(prefix="image_server") as tmp:
+        if source is None:
+            source = os.path.join(tmp, "input" + ext)
+            with open(source, "wb") as f:
+                f.write(base64.b64decode(data))
+        pipeline = Pipeline(steps, engine=engine)
+        if output is not None:
+            pipeline.run(source, output)
+            return {"output": output}
+        output = os.path.join(tmp, "output" + (output_ext or ext))
+        pipeline.run(source, output)
+        with open(output, "rb") as f:
+            return {"data": base64.b64encode(f.read()).decode("ascii")}
+
+
+def percentile(values, fraction):
+    "The nearest-rank percentile of a sorted list, None if it is empty"
+    if not values:
+        return None
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class JobServer(object):
+
+    def __init__(self, engine="pixel", workers=None, max_queue=16):
+        """Run jobs with engine on workers processes (default: one per CPU),
+        rejecting jobs while max_queue of them are queued or running"""
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine %r, use one of %s" % (engine, ENGINES))
+        if max_queue < 1:
+            raise ValueError("max_queue must be positive, not %r" % max_queue)
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.executor = None
+        # Jobs queued or running right now.
+        self.pending = 0
+        self.counts = {"done": 0, "failed": 0, "rejected": 0}
+        self.latencies = deque(maxlen=HISTORY)
+
+    def stats(self):
+        "Return the queue depth, counters and latency percentiles as a dict"
+        latencies = sorted(self.latencies)
+        stats = {"queue": self.pending, "max_queue": self.max_queue,
+                 "workers": self.workers,
+                 "latency": dict(("p%d" % (fraction * 100), percentile(latencies, fraction))
+                                 for fraction in (0.5, 0.95, 0.99))}
+        stats.update(self.counts)
+        return stats
+
+    async def run(self, job):
+        "Answer a single job (a dict)"
+        op = job.get("op", "filter")
+        if op == "stats":
+            return {"ok": True, "stats": self.stats()}
+        if op != "filter":
+            return {"ok": False, "error": "unknown op %r" % op}
+        try:
+            steps = parse_steps(job.get("filters", []))
+            # Fails early for unknown filters.
+            Pipeline(steps, engine=self.engine)
+            if ("input" in job) == ("data" in job):
+                raise ValueError("a job needs either an input file or data")
+            check_ext(job.get("format", ".png"))
+            if job.get("output_format") is not None:
+                check_ext(job["output_format"])
+        except (ValueError, TypeError) as error:
+            return {"ok": False, "error": "bad job: %s" % error}
+        if self.pending >= self.max_queue:
+            self.counts["rejected"] += 1
+            return {"ok": False, "error": "overloaded", "queue": self.pending}
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, run_job, steps, self.engine, job.get("input"),
+                job.get("data"), job.get("format", ".png"), job.get("output"),
+                job.get("output_format"))
+        except Exception as error:
+            self.counts["failed"] += 1
+            return {"ok": False, "error": "%s: %s" % (type(error).__name__, error)}
+        finally:
+            self.pending -= 1
+        seconds = time.perf_counter() - start
+        self.latencies.append(seconds)
+        self.counts["done"] += 1
+        result.update(ok=True, seconds=seconds)
+        return result
+
+    async def answer(self, line, writer):
+        "Run the job in line and write the answer"
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError("a job must be a JSON object")
+        except ValueError as error:
+            response = {"ok": False, "error": "bad job: %s" % error}
+        else:
+            response = await self.run(job)
+            response["id"] = job.get("id")
+        writer.write(json.dumps(response).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        "Serve one connection, answering its jobs concurrently"
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            writer.close()
+
+    async def start(self, unix=None, host="127.0.0.1", port=8765):
+        "Start the worker pool and listen on a Unix socket or a TCP port"
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers)
+        if unix is None:
+            return await asyncio.start_server(self.handle, host, port, limit=1 << 30)
+        # Remove a socket left behind by an earlier server.
+        if os.path.exists(unix) and stat.S_ISSOCK(os.stat(unix).st_mode):
+            os.unlink(unix)
+        return await asyncio.start_unix_server(self.handle, unix, limit=1 << 30)
+
+    async def serve(self, unix=None, host="127.0.0.1", port=8765):
+        "Serve until cancelled"
+        server = await self.start(unix, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def request(job, unix=None, host="127.0.0.1", port=8765):
+    "Send a single job to a server and return its answer"
+    if unix is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(unix)
+    else:
+        sock = socket.create_connection((host, port))
+    with sock, sock.makefile("rb") as answers:
+        sock.sendall(json.dumps(job).encode("utf-8") + b"\n")
+        return json.loads(answers.readline())
+
+
+def main(argv=None):
+    "Command line entry point"
+    parser = argparse.ArgumentParser(description="Serve filter jobs to local processes.")
+    parser.add_argument("--unix", metavar="PATH", help="listen on this Unix socket")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="listen on this address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="listen on this port (default: 8765)")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="pixel")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--max-queue", type=int, default=16,
+                        help="reject jobs while this many are queued or "
+                        "running (default: 16)")
+    args = parser.parse_args(argv)
+    server = JobServer(args.engine, args.workers, args.max_queue)
+    try:
+        asyncio.run(server.serve(args.unix, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
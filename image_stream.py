@@ -0,0 +1,316 @@
+""" Image Stream: run filter pipelines strip by strip, for images larger than RAM
+
+    ImageFilter holds the source, a full copy of it and (on the array engine)
+    arrays of both, which is too much for gigapixel scans. Streaming reads the
+    source in horizontal strips of strip_rows rows and pushes them through
+    the filters one strip at a time:
+
+        stream("scan.ppm", "scan_avg.png", [("average", {"radius": 2})])
+
+    Point filters work on each strip on its own. Neighborhood filters keep a
+    rolling buffer of the strip plus radius rows above and below it (3 rows
+    for a 3x3 sobel, median or average with strip_rows=1) and emit rows as
+    soon as all of their neighbors have been read. The filters themselves are
+    the image_array ones, and just like image_tiles the result is identical
+    to running them on the whole image. Peak memory grows with the width of
+    the image times strip_rows, not with its height.
+
+    PPM/PGM (P6/P5) sources are memory mapped (see image_ppm), so their
+    strips are views of the file. 8 bit, non-interlaced PNGs are inflated
+    and unfiltered strip by strip. Other formats (JPEG, interlaced PNG, ...)
+    are decoded whole by PIL and then cut into strips, so for those memory
+    does grow with the height; open_strips warns about that. Results are
+    written as they come in, as PNG or PPM. Requires NumPy.
+"""
+
+
+import io
+import struct
+import warnings
+import zlib
+from collections import deque
+from functools import partial
+from os.path import splitext
+
+import numpy as np
+from PIL import Image as PIL_Image
+
+import image_array
+import image_lut
+import image_ppm
+from image_filter import POINT_OPS, WINDOWS, load_array_engine, point_ops
+
+
+STRIP_ROWS = 64
+# Channels of the 8 bit PNG colour types: grey, RGB, palette, grey+alpha, RGBA.
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+## Sources. Each returns (width, height, iterator of (rows, width, 3) strips).
+def ppm_strips(filename, strip_rows=STRIP_ROWS):
+    "Cut a memory mapped PPM or PGM file into strips, PPM strips are views"
+    ppm = image_ppm.PPMFile(filename)
+
+    def strips():
+        with ppm:
+            for top in range(0, ppm.height, strip_rows):
+                bottom = min(top + strip_rows, ppm.height)
+                strip = np.frombuffer(ppm.rows(top, bottom), dtype=np.uint8)
+                strip = strip.reshape(bottom - top, ppm.width, ppm.channels)
+                if ppm.channels == 1:
+                    strip = np.repeat(strip, 3, axis=2)
+                yield strip
+                # The strip must be gone before the mapping can be closed.
+                del strip
+    return ppm.width, ppm.height, strips()
+
+def pil_strips(filename, strip_rows=STRIP_ROWS):
+    "Decode any file PIL reads and cut it into strips"
+    im = PIL_Image.open(filename)
+    if im.mode != "RGB":
+        im = im.convert("RGB")
+    width, height = im.size
+
+    def strips():
+        for top in range(0, height, strip_rows):
+            box = (0, top, width, min(top + strip_rows, height))
+            yield np.asarray(im.crop(box))
+    return width, height, strips()
+
+def png_chunks(f):
+    "Yield the (type, data) chunks of the PNG file f up to IEND"
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            raise ValueError("%r is truncated" % f.name)
+        length, kind = struct.unpack(">I4s", head)
+        data = f.read(length)
+        f.read(4)
+        if kind == b"IEND":
+            return
+        yield kind, data
+
+def inflate(chunks, limit=1 << 20):
+    "Decompress the IDAT data of chunks, at most limit bytes at a time"
+    decompressor = zlib.decompressobj()
+    for kind, data in chunks:
+        if kind != b"IDAT":
+            continue
+        while data:
+            yield decompressor.decompress(data, limit)
+            data = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+def png_strips(filename, strip_rows=STRIP_ROWS):
+    """Decode a PNG file strip by strip. Only the compressed rows of the
+    current strip are inflated; they are unfiltered by PIL as a small PNG of
+    their own, which starts with the last row of the strip before (PNG rows
+    are filtered against the row above). Interlaced PNGs and bit depths other
+    than 8 are decoded whole, see pil_strips."""
+    f = open(filename, "rb")
+    if f.read(8) != b"\x89PNG\r\n\x1a\n":
+        f.close()
+        raise ValueError("%r is not a PNG file" % filename)
+    chunks = png_chunks(f)
+    kind, ihdr = next(chunks)
+    width, height, depth, color, compression, filtering, interlace = \
+        struct.unpack(">IIBBBBB", ihdr)
+    if kind != b"IHDR" or depth != 8 or interlace or color not in PNG_CHANNELS:
+        f.close()
+        return pil_strips(filename, strip_rows)
+    stride = width * PNG_CHANNELS[color] + 1
+    # The chunks before the pixel data that PIL needs, i.e. the palette.
+    extra = []
+    def pixels():
+        for kind, data in chunks:
+            if kind == b"PLTE":
+                extra.append((kind, data))
+            yield kind, data
+
+    def strips():
+        with f:
+            buf = bytearray()
+            above = None
+            top = 0
+            for data in inflate(pixels()):
+                buf += data
+                while top < height:
+                    rows = min(strip_rows, height - top)
+                    if len(buf) < rows * stride:
+                        break
+                    raw = bytes(buf[:rows * stride])
+                    del buf[:rows * stride]
+                    if above is not None:
+                        # Filter type 0: the row above as it is.
+                        raw = b"\x00" + above + raw
+                    png = io.BytesIO()
+                    png.write(b"\x89PNG\r\n\x1a\n")
+                    png_chunk(png, b"IHDR", struct.pack(">IIBBBBB", width, len(raw) // stride,
+                                                         8, color, 0, 0, 0))
+                    for chunk in extra:
+                        png_chunk(png, *chunk)
+                    png_chunk(png, b"IDAT", zlib.compress(raw, 0))
+                    png_chunk(png, b"IEND", b"")
+                    im = PIL_Image.open(png)
+                    im.load()
+                    above = im.tobytes()[-(stride - 1):]
+                    if im.mode != "RGB":
+                        im = im.convert("RGB")
+                    strip = np.asarray(im)
+                    yield strip[-rows:]
+                    top += rows
+            if top < height:
+                raise ValueError("%r is truncated" % filename)
+    return width, height, strips()
+
+def open_strips(filename, strip_rows=STRIP_ROWS):
+    """Return (width, height, strips) of filename. PPM, PGM and PNG files are
+    read strip by strip, anything else is decoded whole (with a warning)."""
+    ext = splitext(filename)[1].lower()
+    if ext in image_ppm.EXTENSIONS:
+        return ppm_strips(filename, strip_rows)
+    if ext == ".png":
+        return png_strips(filename, strip_rows)
+    warnings.warn("%s files can't be read strip by strip, %r is decoded whole"
+                  % (ext, filename))
+    return pil_strips(filename, strip_rows)
+
+
+## Stages. Each takes an iterator of strips and yields the filtered strips.
+def point_stage(strips, ops):
+    "Apply a list of lookup tables and image_array point functions"
+    for strip in strips:
+        for op in ops:
+            strip = op(strip)
+        yield strip
+
+def window_stage(strips, height, halo, func, args=(), strip_rows=STRIP_ROWS):
+    """Apply a neighborhood filter func(arr, *args) with the given radius
+    (halo). Only the rows of the current output strip plus halo rows on each
+    side are kept."""
+    rows = deque()
+    # The image row of rows[0] and the first row we haven't emitted yet.
+    first = top = 0
+    for strip in strips:
+        rows.extend(strip)
+        # Emit every output strip whose neighborhood has been read completely.
+        while top < height:
+            bottom = min(top + strip_rows, height)
+            if first + len(rows) < min(bottom + halo, height):
+                break
+            out = func(np.stack(rows), *args)
+            yield out[top - first:bottom - first]
+            top = bottom
+            while first < top - halo:
+                rows.popleft()
+                first += 1
+
+def double_stage(strips):
+    "Double the size of the image, every pixel becomes a 2x2 block"
+    for strip in strips:
+        yield strip.repeat(2, axis=0).repeat(2, axis=1)
+
+
+## Steps, compiled with the array engine helpers of image_filter.
+def strip_ops(name, params):
+    """Compile a point filter into functions that map a strip to a new strip,
+    leaving out tables that change nothing"""
+    return [partial(image_array.apply_lut, lut=op[1]) if op[0] == "lut" else op[2]
+            for op in point_ops(name, **params)
+            if op[0] != "lut" or not image_lut.is_identity(op[1])]
+
+def compile_steps(steps):
+    """Turn steps (filter names or (name, params) tuples) into a list of
+    ("point", ops), ("double",) and ("window", func, args, halo) stages.
+    Raises a ValueError for steps that can't be streamed, before anything
+    is read."""
+    # The filters of image_filter only get their array functions with the
+    # array engine loaded.
+    load_array_engine()
+    stages = []
+    for step in steps:
+        if isinstance(step, str):
+            step = (step, {})
+        name, params = step
+        if name in POINT_OPS:
+            stages.append(("point", strip_ops(name, params)))
+        elif name == "double":
+            stages.append(("double",))
+        elif name in WINDOWS:
+            stages.append(("window",) + WINDOWS[name](**params))
+        elif name in ("resize", "thumbnail"):
+            raise ValueError("%s can't be streamed, it needs the whole image" % name)
+        else:
+            raise ValueError("Unknown filter %r" % name)
+    return stages
+
+
+## Writers. Each takes (filename, width, height, strips).
+def png_chunk(f, kind, data):
+    "Write one PNG chunk: length, type, data and CRC"
+    f.write(struct.pack(">I", len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+def write_png(filename, width, height, strips):
+    "Write an RGB PNG, compressing the strips as they come in"
+    compressor = zlib.compressobj()
+    # Every row is stored as its difference to the row above (PNG filter
+    # type 2, "Up"), which compresses photos much better than raw rows.
+    above = np.zeros(width * 3, dtype=np.uint8)
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        for strip in strips:
+            rows = np.ascontiguousarray(strip).reshape(len(strip), width * 3)
+            lines = np.empty((len(rows), width * 3 + 1), dtype=np.uint8)
+            lines[:, 0] = 2
+            lines[0, 1:] = rows[0] - above
+            lines[1:, 1:] = rows[1:] - rows[:-1]
+            above = rows[-1].copy()
+            data = compressor.compress(lines.tobytes())
+            if data:
+                png_chunk(f, b"IDAT", data)
+        png_chunk(f, b"IDAT", compressor.flush())
+        png_chunk(f, b"IEND", b"")
+
+def write_ppm(filename, width, height, strips):
+    "Write a binary PPM (P6) file, copying the strips into a memory map of it"
+    with image_ppm.create(filename, width, height) as ppm:
+        out = np.frombuffer(ppm.data, dtype=np.uint8).reshape(height, width, 3)
+        top = 0
+        for strip in strips:
+            out[top:top + len(strip)] = strip
+            top += len(strip)
+        del out
+
+WRITERS = {
+    ".png": write_png,
+    ".ppm": write_ppm,
+}
+
+
+def stream(img_file, out_file, steps, strip_rows=STRIP_ROWS):
+    """Run steps (filter names or (name, params) tuples, like Pipeline) over
+    img_file strip by strip and write the result to out_file, which must be
+    a .png or .ppm file. Returns the (width, height) of the result."""
+    writer = WRITERS.get(splitext(out_file)[1].lower())
+    if writer is None:
+        raise ValueError("Streamed results can only be written as %s"
+                         % ", ".join(sorted(WRITERS)))
+    if strip_rows < 1:
+        raise ValueError("strip_rows must be positive, not %r" % strip_rows)
+    stages = compile_steps(steps)
+    width, height, strips = open_strips(img_file, strip_rows)
+    for stage in stages:
+        if stage[0] == "point":
+            strips = point_stage(strips, stage[1])
+        elif stage[0] == "double":
+            strips = double_stage(strips)
+            width, height = width * 2, height * 2
+        else:
+            kind, func, args, halo = stage
+            strips = window_stage(strips, height, halo, func, args, strip_rows)
+    writer(out_file, width, height, strips)
+    return width, height
@@ -0,0 +1,22 @@
+""" Regression tests for image_array, run with python -m unittest """
+
+
+import unittest
+
+import numpy as np
+
+import image_array
+
+
+class MedianTest(unittest.TestCase):
+
+    def test_wide_flat_image(self):
+        # The column prefix sums of wide images used to wrap around.
+        for value, width, radius in ((255, 8000, 4), (200, 23000, 1)):
+            arr = np.full((6, width, 3), value, dtype=np.uint8)
+            out = image_array.median_filter(arr, radius)
+            self.assertTrue((out == value).all())
+
+
+if __name__ == "__main__":
+    unittest.main()